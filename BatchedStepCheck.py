@@ -0,0 +1,72 @@
+"""
+Equivalence check for StateManager.apply_actions_batched().
+
+The batched real step must give exactly the same result as the per-agent
+apply_actions(). This runs both on two identical environments with the same
+seeded random joint actions (and the same RNG state before every step, so the
+particle resampling draws the same numbers) and compares positions,
+observations, rewards, beliefs and particles after every step. It exits with
+status 1 at the first difference.
+
+    python BatchedStepCheck.py --steps 30 --seed 1
+"""
+import argparse
+import sys
+import numpy as np
+from DataLoading import DataLoader as DL
+from BeliefStateManager import BeliefManager as BM
+from State_Manager import StateManager as SM
+
+
+def compare(step, reference, batched, belief_ref, belief_batched, agent_ids):
+    """ Names of everything that differs between the two steps' results and managers. """
+    (pos_1, obs_1, rew_1), (pos_2, obs_2, rew_2) = reference, batched
+    diffs = []
+    if pos_1 != pos_2:
+        diffs.append(f"positions {pos_1} != {pos_2}")
+    if obs_1 != obs_2:
+        diffs.append("observations")
+    for aid in agent_ids:
+        if rew_1[aid] != rew_2[aid]:
+            diffs.append(f"reward of agent {aid}: {rew_1[aid]} != {rew_2[aid]}")
+        if not np.array_equal(belief_ref.belief[aid], belief_batched.belief[aid]):
+            diffs.append(f"belief of agent {aid}")
+        if not np.array_equal(np.asarray(belief_ref.particles[aid]), np.asarray(belief_batched.particles[aid])):
+            diffs.append(f"particles of agent {aid}")
+    return [f"step {step}: {d}" for d in diffs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--map", default="MAP_KRR.xlsx")
+    args = parser.parse_args()
+
+    grid = DL(args.map).load_data().to_numpy(dtype=int)
+    agents = {i + 1: tuple(int(x) for x in p) for i, p in enumerate(np.argwhere(grid == 2))}
+    goals = {i + 1: tuple(int(x) for x in p) for i, p in enumerate(np.argwhere(grid == 3))}
+    agent_ids = list(agents)
+
+    belief_ref, belief_batched = BM(grid, agent_ids), BM(grid, agent_ids)
+    state_ref = SM(grid, agents, goals, belief_ref)
+    state_batched = SM(grid, agents, goals, belief_batched)
+
+    rng = np.random.RandomState(args.seed)
+    actions = ["up", "down", "left", "right", "stay"]
+    for t in range(args.steps):
+        joint_action = {aid: actions[rng.randint(len(actions))] for aid in agent_ids}
+        np.random.seed(args.seed * 1000 + t)
+        reference = state_ref.apply_actions(joint_action)
+        np.random.seed(args.seed * 1000 + t)
+        batched = state_batched.apply_actions_batched(joint_action)
+
+        diffs = compare(t, reference, batched, belief_ref, belief_batched, agent_ids)
+        if diffs:
+            print("\n".join(diffs))
+            sys.exit(1)
+    print(f"apply_actions_batched matches apply_actions over {args.steps} steps")
+
+
+if __name__ == "__main__":
+    main()
@@ -35,3 +35,14 @@ class BeliefManager:
         self.particles[agent_id] = particles
         return particles
 
+    def set_beliefs(self, agent_ids, beliefs, num_particles=100):
+        """
+        Write already-updated beliefs for several agents at once and resample
+        all their particles in a single draw.
+        beliefs: (n_agents, H, W) array, in the order of agent_ids
+        """
+        rand = np.random.rand(len(agent_ids), num_particles, self.H, self.W)
+        particles = (rand < beliefs[:, None]).astype(np.uint8)
+        for i, aid in enumerate(agent_ids):
+            self.belief[aid] = beliefs[i]
+            self.particles[aid] = particles[i]
@@ -0,0 +1,330 @@
+"""
+Checkpoint / restore of the full planner state, and warm starts.
+
+A checkpoint directory holds a small meta.json (format version, map size,
+agents, latest checkpoint) and one sub-directory per saved step:
+
+    ckpt_<step>/state.json           step, positions, best distances, RNG state
+    ckpt_<step>/belief.npy           (n_agents, H, W) beliefs
+    ckpt_<step>/particles_<i>.npy    particles of agent i
+    ckpt_<step>/visited.npy          (K, 3) rows of (agent index, row, col)
+    ckpt_<step>/trails.npy           (T, n_agents, 2)
+    ckpt_<step>/tree_<i>.npy         search tree of agent i, one record per node
+    ckpt_<step>/tree_<i>_obs.npy     its observation labels, packed as cell values
+    ckpt_<step>/tree_<i>_labels.json any other labels (bucketed observations), as nested lists
+    ckpt_<step>/tree_<i>_amaf.npy    AMAF stats of the selection policy, (node, action, n, V) rows
+    ckpt_<step>/tree_<i>_priors.npy  PUCT priors, (node, P per action) rows
+
+Everything large is a plain .npy file, so it is loaded with mmap and only
+the pages actually used are read. Transposition tables are caches and are
+not saved, everything else in the nodes is (a restored RAVE or PUCT search
+continues exactly like the uninterrupted one). Nothing is pickled, so a checkpoint from another host is safe to load.
+"""
+import json
+import os
+import shutil
+import numpy as np
+from Tree import TreeBuilder
+from MAC import MultiAgentController as MAC
+
+CHECKPOINT_VERSION = 3
+
+# node kinds in a packed tree
+_ROOT, _ACTION, _OBS, _OTHER = 0, 1, 2, 3
+_NODE_DTYPE = np.dtype([("parent", "i4"), ("kind", "i1"), ("label", "i4"), ("N", "i4"), ("V", "f8")])
+_AMAF_DTYPE = np.dtype([("node", "i4"), ("action", "i1"), ("n", "i4"), ("V", "f8")])
+
+
+def _priors_dtype(n_actions):
+    return np.dtype([("node", "i4"), ("P", "f8", (n_actions,))])
+
+
+# -------------------------------------------------------
+# 1. Trees <-> arrays
+# -------------------------------------------------------
+def _pack_tree(tree: TreeBuilder, actions, state_mgr):
+    H, W = state_mgr.H, state_mgr.W
+    records, obs_rows, obs_goal, others = [], [], [], []
+    amaf, priors = [], []  # per-node selection policy data
+    obs_index = {}
+    index = {tree.root: 0}
+    order = [tree.root]
+
+    for hist in order:  # breadth first, parents before children
+        data = tree.nodes[hist]
+        if hist == tree.root:
+            kind, label_id = _ROOT, -1
+        else:
+            label = hist[-1]
+            if data["is_action"]:
+                kind, label_id = _ACTION, actions.index(str(label))
+            elif isinstance(label, tuple) and len(label) == H * W + 1:
+                kind = _OBS
+                if label not in obs_index:
+                    values, goal_dir = state_mgr.pack_observation(label)
+                    obs_index[label] = len(obs_rows)
+                    obs_rows.append(values)
+                    obs_goal.append(goal_dir)
+                label_id = obs_index[label]
+            else:
+                kind, label_id = _OTHER, len(others)
+                others.append(label)
+        parent = -1 if hist == tree.root else index[data["parent"]]
+        for a, (n, V) in data.get("amaf", {}).items():
+            amaf.append((len(records), actions.index(str(a)), n, V))
+        if "P" in data:
+            priors.append((len(records), [data["P"][a] for a in actions]))
+        records.append((parent, kind, label_id, data["N"], data["V"]))
+
+        for child in data["children"].values():
+            index[child] = len(order)
+            order.append(child)
+
+    nodes = np.array(records, dtype=_NODE_DTYPE)
+    obs = np.zeros((len(obs_rows), H * W + 2), dtype=np.int8)
+    if obs_rows:
+        obs[:, :H * W] = obs_rows
+        obs[:, H * W:] = obs_goal
+    return nodes, obs, others, np.array(amaf, dtype=_AMAF_DTYPE), np.array(priors, dtype=_priors_dtype(len(actions)))
+
+
+def _as_tuple(x):
+    """ Labels come back from JSON as nested lists, the tree keys them by nested tuples. """
+    return tuple(_as_tuple(v) for v in x) if isinstance(x, list) else x
+
+
+def _unpack_tree(tree: TreeBuilder, nodes, obs, others, amaf, priors, actions, state_mgr):
+    """
+    Fill an empty tree from the packed records. If the tree has a smaller
+    budget than the saved one, the deepest nodes are left out (records are
+    breadth first).
+    """
+    H, W = state_mgr.H, state_mgr.W
+    obs_cache = {}
+    hists = []
+    for parent, kind, label_id, N, V in nodes.tolist():
+        if kind == _ROOT:
+            hist = tree.root
+            tree.nodes[hist]["N"], tree.nodes[hist]["V"] = N, V
+            hists.append(hist)
+            continue
+
+        if kind == _ACTION:
+            label = actions[label_id]
+        elif kind == _OBS:
+            if label_id not in obs_cache:
+                obs_cache[label_id] = state_mgr.unpack_observation(obs[label_id, :H * W], obs[label_id, H * W:])
+            label = obs_cache[label_id]
+        else:
+            label = others[label_id]
+
+        parent_hist = hists[parent]
+        hist = None if parent_hist is None else tree.add_node(parent_hist, label, kind == _ACTION)
+        if hist is not None:
+            tree.nodes[hist]["N"], tree.nodes[hist]["V"] = N, V
+        hists.append(hist)
+
+    for node, action, n, V in amaf.tolist():
+        if hists[node] is not None:
+            tree.nodes[hists[node]].setdefault("amaf", {})[actions[action]] = (n, V)
+    for node, P in priors.tolist():
+        if hists[node] is not None:
+            tree.nodes[hists[node]]["P"] = dict(zip(actions, P))
+    return tree
+
+
+# -------------------------------------------------------
+# 2. Save / load
+# -------------------------------------------------------
+def _read_meta(path):
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    if meta["version"] != CHECKPOINT_VERSION:
+        raise ValueError(f"unsupported checkpoint version {meta['version']}")
+    return meta
+
+
+def _check_compatible(meta, controller: MAC):
+    state_mgr = controller.state_mgr
+    if (meta["H"], meta["W"]) != (state_mgr.H, state_mgr.W):
+        raise ValueError(f"checkpoint is for a {meta['H']}x{meta['W']} map, "
+                         f"controller has {state_mgr.H}x{state_mgr.W}")
+    if meta["agent_ids"] != list(controller.agent_ids):
+        raise ValueError(f"checkpoint agents {meta['agent_ids']} != controller agents {list(controller.agent_ids)}")
+
+
+def latest_checkpoint(path):
+    """ Step of the latest checkpoint in path, or None if there is none. """
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    return _read_meta(path)["latest"]
+
+
+def save_checkpoint(path, controller: MAC, step, include_trees=True, keep=2):
+    """
+    Write the controller state after `step` completed steps, then make it the
+    latest checkpoint (older ones beyond `keep` are removed).
+    """
+    state_mgr, belief_mgr = controller.state_mgr, controller.belief_mgr
+    agent_ids = list(controller.agent_ids)
+    actions = list(controller.agents[agent_ids[0]].actions)
+    os.makedirs(path, exist_ok=True)
+
+    name = f"ckpt_{step:08d}"
+    tmp = os.path.join(path, name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    rng = np.random.get_state()
+    state = {
+        "step": step,
+        "agent_pos": [[int(x) for x in state_mgr.agent_pos[aid]] for aid in agent_ids],
+        "best_distance": [int(state_mgr.best_distance[aid]) for aid in agent_ids],
+        "include_trees": include_trees,
+        "rng": [rng[0], int(rng[2]), int(rng[3]), float(rng[4])],
+    }
+    with open(os.path.join(tmp, "state.json"), "w") as f:
+        json.dump(state, f)
+    np.save(os.path.join(tmp, "rng_keys.npy"), rng[1])
+
+    np.save(os.path.join(tmp, "belief.npy"), np.stack([belief_mgr.belief[aid] for aid in agent_ids]))
+    for i, aid in enumerate(agent_ids):
+        parts = np.asarray(belief_mgr.particles[aid], dtype=np.uint8).reshape(-1, state_mgr.H, state_mgr.W)
+        np.save(os.path.join(tmp, f"particles_{i}.npy"), parts)
+
+    visited = [(i, r, c) for i, aid in enumerate(agent_ids) for r, c in state_mgr.visited[aid]]
+    np.save(os.path.join(tmp, "visited.npy"), np.array(visited, dtype=np.int32).reshape(-1, 3))
+    trails = np.array([[controller.trails[aid][t] for aid in agent_ids]
+                       for t in range(min(len(controller.trails[aid]) for aid in agent_ids))], dtype=np.int16)
+    np.save(os.path.join(tmp, "trails.npy"), trails.reshape(-1, len(agent_ids), 2))
+
+    if include_trees:
+        for i, aid in enumerate(agent_ids):
+            nodes, obs, others, amaf, priors = _pack_tree(controller.agents[aid].tree, actions, state_mgr)
+            np.save(os.path.join(tmp, f"tree_{i}.npy"), nodes)
+            np.save(os.path.join(tmp, f"tree_{i}_obs.npy"), obs)
+            np.save(os.path.join(tmp, f"tree_{i}_amaf.npy"), amaf)
+            np.save(os.path.join(tmp, f"tree_{i}_priors.npy"), priors)
+            with open(os.path.join(tmp, f"tree_{i}_labels.json"), "w") as f:
+                json.dump(others, f)
+
+    final = os.path.join(path, name)
+    shutil.rmtree(final, ignore_errors=True)
+    os.replace(tmp, final)
+
+    # publish: meta.json is swapped in atomically, so a crash never leaves a half-written latest
+    previous = latest_checkpoint(path)
+    history = [s for s in (_read_meta(path)["history"] if previous is not None else []) if s != step] + [step]
+    meta = {
+        "version": CHECKPOINT_VERSION,
+        "H": state_mgr.H,
+        "W": state_mgr.W,
+        "agent_ids": agent_ids,
+        "actions": actions,
+        "latest": step,
+        "history": history[-keep:],
+    }
+    with open(os.path.join(path, "meta.json.tmp"), "w") as f:
+        json.dump(meta, f)
+    os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))
+
+    for old in history[:-keep]:
+        shutil.rmtree(os.path.join(path, f"ckpt_{old:08d}"), ignore_errors=True)
+
+
+def load_checkpoint(path, controller: MAC, step=None, mmap=True):
+    """
+    Restore a checkpoint (the latest one by default) into a controller built
+    for the same map and agents. Returns the number of completed steps.
+    With mmap, particles stay memory-mapped and are only paged in when sampled.
+    """
+    meta = _read_meta(path)
+    _check_compatible(meta, controller)
+    step = meta["latest"] if step is None else step
+    ckpt = os.path.join(path, f"ckpt_{step:08d}")
+    mode = "r" if mmap else None
+    state_mgr, belief_mgr = controller.state_mgr, controller.belief_mgr
+    agent_ids = list(controller.agent_ids)
+
+    with open(os.path.join(ckpt, "state.json")) as f:
+        state = json.load(f)
+    rng = state["rng"]
+    np.random.set_state((rng[0], np.load(os.path.join(ckpt, "rng_keys.npy")), rng[1], rng[2], rng[3]))
+
+    for i, aid in enumerate(agent_ids):
+        state_mgr.agent_pos[aid] = tuple(state["agent_pos"][i])
+        state_mgr.best_distance[aid] = state["best_distance"][i]
+    visited = np.load(os.path.join(ckpt, "visited.npy")).tolist()
+    state_mgr.visited = {aid: set() for aid in agent_ids}
+    for i, r, c in visited:
+        state_mgr.visited[agent_ids[i]].add((r, c))
+
+    _load_beliefs(ckpt, belief_mgr, agent_ids, mode)
+
+    trails = np.load(os.path.join(ckpt, "trails.npy")).tolist()
+    controller.trails = {aid: [tuple(p[i]) for p in trails] for i, aid in enumerate(agent_ids)}
+    controller.histories = {aid: () for aid in agent_ids}
+
+    for i, aid in enumerate(agent_ids):
+        planner = controller.agents[aid]
+        if state["include_trees"]:
+            nodes = np.load(os.path.join(ckpt, f"tree_{i}.npy"), mmap_mode=mode)
+            obs = np.load(os.path.join(ckpt, f"tree_{i}_obs.npy"), mmap_mode=mode)
+            amaf = np.load(os.path.join(ckpt, f"tree_{i}_amaf.npy"))
+            priors = np.load(os.path.join(ckpt, f"tree_{i}_priors.npy"))
+            with open(os.path.join(ckpt, f"tree_{i}_labels.json")) as f:
+                others = [_as_tuple(label) for label in json.load(f)]
+            planner.tree = _unpack_tree(planner.new_tree(), nodes, obs, others, amaf, priors, meta["actions"], state_mgr)
+        else:
+            planner.tree = planner.new_tree()
+        if planner.transpositions is not None:
+            planner.transpositions.clear()
+
+    return state["step"]
+
+
+def _load_beliefs(ckpt, belief_mgr, agent_ids, mode):
+    belief = np.load(os.path.join(ckpt, "belief.npy"))
+    for i, aid in enumerate(agent_ids):
+        belief_mgr.belief[aid] = belief[i].copy()  # updated in place during the episode
+        parts = np.load(os.path.join(ckpt, f"particles_{i}.npy"), mmap_mode=mode)
+        belief_mgr.particles[aid] = parts if len(parts) else []
+
+
+def warm_start(path, controller: MAC, step=None, mmap=True):
+    """
+    Start a new episode on the same map from a prior belief: only the beliefs
+    and particles are taken from the checkpoint, positions and trees stay fresh.
+    """
+    meta = _read_meta(path)
+    _check_compatible(meta, controller)
+    step = meta["latest"] if step is None else step
+    _load_beliefs(os.path.join(path, f"ckpt_{step:08d}"), controller.belief_mgr,
+                  list(controller.agent_ids), "r" if mmap else None)
+
+
+class Checkpointer:
+    """
+    Incremental checkpoints: call step(t) after every step, a checkpoint is
+    written every `every` steps and only the last `keep` are kept on disk.
+    """
+    def __init__(self, path, controller: MAC, every=10, keep=2, include_trees=True):
+        self.path = path
+        self.controller = controller
+        self.every = every
+        self.keep = keep
+        self.include_trees = include_trees
+        self.last_saved = None
+
+    def step(self, completed_steps, force=False):
+        if completed_steps == self.last_saved:
+            return
+        if force or completed_steps % self.every == 0:
+            save_checkpoint(self.path, self.controller, completed_steps, self.include_trees, self.keep)
+            self.last_saved = completed_steps
+
+    def resume(self, mmap=True):
+        """ Restore the latest checkpoint if there is one. Returns the steps already done (0 if none). """
+        if latest_checkpoint(self.path) is None:
+            return 0
+        return load_checkpoint(self.path, self.controller, mmap=mmap)
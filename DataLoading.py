@@ -1,5 +1,3 @@
-import pandas as pd
-
 class DataLoader:
     def __init__(self, path):
         self.path = path
@@ -8,6 +6,7 @@ class DataLoader:
     # 1. Loading Data from Excel
     # -------------------------------------------------------
     def load_data(self):
+        import pandas as pd  # only needed here, keeps the planning core free of pandas
         try:
             # Attempt to read the excel file
             self.df = pd.read_excel(self.path)
@@ -0,0 +1,294 @@
+"""
+Episode traces: compact on-disk record of an episode and a replayer for it.
+
+A trace is a directory:
+    meta.npz                 map, agents, goals, action names, format version
+    chunk_<first step>.npz   compressed block of up to chunk_size steps
+
+Each chunk stores, per step and agent, the action index, position, observation
+id, reward and planner stats, plus the belief cells that changed at that step.
+Every chunk also starts with a full belief keyframe, so any step can be
+reconstructed by loading a single chunk.
+"""
+import bisect
+import os
+import numpy as np
+from MAC import MultiAgentController as MAC
+
+TRACE_VERSION = 1
+
+
+class TraceWriter:
+    def __init__(self, path, controller: MAC, chunk_size=256, start_step=0):
+        """
+        start_step: > 0 when the episode was resumed from a checkpoint at that
+        step; the existing trace at path is then continued from there (steps
+        it has beyond start_step are dropped) instead of being overwritten.
+        """
+        self.path = path
+        self.controller = controller
+        self.chunk_size = chunk_size
+        self.agent_ids = list(controller.agent_ids)
+        state_mgr = controller.state_mgr
+        self.actions = list(controller.agents[self.agent_ids[0]].actions)
+        self._action_index = {a: i for i, a in enumerate(self.actions)}
+        self._obs_ids = {aid: {} for aid in self.agent_ids}  # observation tuple -> id, per agent
+        self._obs_offset = {aid: 0 for aid in self.agent_ids}  # first free id, after a resume
+
+        if start_step > 0:
+            self._resume(start_step)
+            return
+
+        os.makedirs(path, exist_ok=True)
+        np.savez_compressed(
+            os.path.join(path, "meta.npz"),
+            version=TRACE_VERSION,
+            agent_ids=np.array(self.agent_ids),
+            actions=np.array(self.actions),
+            true_map=state_mgr.true_map,
+            goals=np.array([state_mgr.goal_pos[aid] for aid in self.agent_ids]),
+            start=np.array([state_mgr.agent_pos[aid] for aid in self.agent_ids]),
+            chunk_size=chunk_size)
+
+        self._last_belief = self._beliefs()
+        self._t = 0
+        self._new_chunk()
+
+    def _resume(self, start_step):
+        """
+        Continue the trace at `start_step`. The partly filled chunk it falls in
+        is loaded back into the buffer and rewritten on the next flush.
+        Observation ids are not matched across the resume, new observations
+        get ids above the ones already used.
+        """
+        if not os.path.exists(os.path.join(self.path, "meta.npz")):
+            raise FileNotFoundError(f"no trace at {self.path} to continue at step {start_step}")
+        reader = TraceReader(self.path)
+        if reader.agent_ids != self.agent_ids:
+            raise ValueError(f"trace at {self.path} is for agents {reader.agent_ids}, not {self.agent_ids}")
+        if len(reader) < start_step:
+            raise ValueError(f"trace at {self.path} has {len(reader)} steps, cannot continue it at step {start_step}")
+        self.chunk_size = reader.chunk_size
+
+        if len(reader):
+            used = reader.column("obs_ids").max(axis=0) + 1
+            self._obs_offset = dict(zip(self.agent_ids, used.tolist()))
+
+        i = bisect.bisect_right(reader._starts, start_step) - 1
+        k = start_step - reader._starts[i] if i >= 0 else 0
+        self._last_belief = self._beliefs()
+        self._t = start_step
+        if k == 0 or k >= self.chunk_size:
+            self._new_chunk()
+            keep = start_step - 1
+        else:
+            chunk = reader._chunk(i)
+            self._start = reader._starts[i]
+            self._keyframe = chunk["belief_key"]
+            self._buf = {field: chunk[field][:k].tolist() for field in
+                         ("actions", "positions", "obs_ids", "rewards", "plan_time", "tree_nodes", "root_visits")}
+            mask = chunk["delta_step"] < k
+            self._deltas = [tuple(chunk[f][mask] for f in ("delta_step", "delta_agent", "delta_cell", "delta_value"))]
+            keep = self._start  # this chunk is rewritten by flush()
+
+        for first, f in zip(reader._starts, reader._files):
+            if first > keep:
+                os.remove(f)
+
+    def _beliefs(self):
+        belief = self.controller.belief_mgr.belief
+        return np.stack([belief[aid] for aid in self.agent_ids]).astype(np.float32)
+
+    def _new_chunk(self):
+        self._start = self._t
+        self._keyframe = self._last_belief.copy()
+        self._buf = {k: [] for k in ("actions", "positions", "obs_ids", "rewards",
+                                     "plan_time", "tree_nodes", "root_visits")}
+        self._deltas = []  # (step, agent, flat cell, new value) arrays
+
+    def record(self, joint_action, observations, rewards):
+        """
+        Append one step, as returned by MultiAgentController.step().
+        Positions, beliefs and planner stats are read from the controller.
+        """
+        ids = self.agent_ids
+        state_mgr = self.controller.state_mgr
+        stats = self.controller.plan_stats
+
+        obs_ids = []
+        for aid in ids:
+            table = self._obs_ids[aid]
+            obs_ids.append(table.setdefault(observations[aid], len(table) + self._obs_offset[aid]))
+
+        buf = self._buf
+        buf["actions"].append([self._action_index[str(joint_action[aid])] for aid in ids])
+        buf["positions"].append([state_mgr.agent_pos[aid] for aid in ids])
+        buf["obs_ids"].append(obs_ids)
+        buf["rewards"].append([rewards[aid] for aid in ids])
+        buf["plan_time"].append([stats[aid]["time"] for aid in ids])
+        buf["tree_nodes"].append([stats[aid]["nodes"] for aid in ids])
+        buf["root_visits"].append([stats[aid]["root_N"] for aid in ids])
+
+        # belief deltas: only the cells that changed since the previous step
+        belief = self._beliefs()
+        agent, cell = np.nonzero((belief != self._last_belief).reshape(len(ids), -1))
+        self._deltas.append((np.full(len(agent), self._t - self._start), agent, cell,
+                             belief.reshape(len(ids), -1)[agent, cell]))
+        self._last_belief = belief
+
+        self._t += 1
+        if self._t - self._start >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """ Write the buffered steps as one compressed chunk. """
+        n = self._t - self._start
+        if n == 0:
+            return
+        step, agent, cell, value = (np.concatenate(col) for col in zip(*self._deltas))
+        buf = self._buf
+        np.savez_compressed(
+            os.path.join(self.path, f"chunk_{self._start:08d}.npz"),
+            belief_key=self._keyframe,
+            actions=np.array(buf["actions"], dtype=np.int8),
+            positions=np.array(buf["positions"], dtype=np.int16),
+            obs_ids=np.array(buf["obs_ids"], dtype=np.int32),
+            rewards=np.array(buf["rewards"], dtype=np.float64),
+            plan_time=np.array(buf["plan_time"], dtype=np.float32),
+            tree_nodes=np.array(buf["tree_nodes"], dtype=np.int32),
+            root_visits=np.array(buf["root_visits"], dtype=np.int32),
+            delta_step=step.astype(np.int32),
+            delta_agent=agent.astype(np.int8),
+            delta_cell=cell.astype(np.int32),
+            delta_value=value.astype(np.float32))
+        self._new_chunk()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TraceReader:
+    def __init__(self, path):
+        self.path = path
+        meta = np.load(os.path.join(path, "meta.npz"))
+        if int(meta["version"]) != TRACE_VERSION:
+            raise ValueError(f"unsupported trace version {int(meta['version'])}")
+        self.agent_ids = meta["agent_ids"].tolist()
+        self.actions = meta["actions"].tolist()
+        self.true_map = meta["true_map"]
+        self.goals = meta["goals"]
+        self.start = meta["start"]
+        self.H, self.W = self.true_map.shape
+        self.chunk_size = int(meta["chunk_size"])
+
+        files = sorted(f for f in os.listdir(path) if f.startswith("chunk_") and f.endswith(".npz"))
+        self._files = [os.path.join(path, f) for f in files]
+        self._starts = [int(f[len("chunk_"):-len(".npz")]) for f in files]
+        self._cache = (None, None)  # (chunk index, loaded arrays)
+        self._len = self._starts[-1] + len(self._chunk(len(files) - 1)["actions"]) if files else 0
+
+    def __len__(self):
+        return self._len
+
+    def _chunk(self, i):
+        if self._cache[0] != i:
+            with np.load(self._files[i]) as z:
+                self._cache = (i, {k: z[k] for k in z.files})
+        return self._cache[1]
+
+    def _locate(self, t):
+        if not 0 <= t < self._len:
+            raise IndexError(f"step {t} out of range [0, {self._len})")
+        i = bisect.bisect_right(self._starts, t) - 1
+        return i, t - self._starts[i]
+
+    def step(self, t):
+        """
+        Everything recorded at step t:
+        {field: {agent_id: value}} for actions, positions, obs_ids, rewards and planner stats.
+        """
+        i, k = self._locate(t)
+        chunk = self._chunk(i)
+        out = {"actions": {aid: self.actions[a] for aid, a in zip(self.agent_ids, chunk["actions"][k])},
+               "positions": {aid: tuple(p) for aid, p in zip(self.agent_ids, chunk["positions"][k].tolist())}}
+        for field in ("obs_ids", "rewards", "plan_time", "tree_nodes", "root_visits"):
+            out[field] = dict(zip(self.agent_ids, chunk[field][k].tolist()))
+        return out
+
+    def belief(self, t):
+        """ Beliefs of all agents after step t: {agent_id: (H, W) array}. """
+        i, k = self._locate(t)
+        chunk = self._chunk(i)
+        belief = chunk["belief_key"].reshape(len(self.agent_ids), -1).copy()
+        upto = np.searchsorted(chunk["delta_step"], k, side="right")  # deltas are in step order
+        belief[chunk["delta_agent"][:upto], chunk["delta_cell"][:upto]] = chunk["delta_value"][:upto]
+        belief = belief.reshape(len(self.agent_ids), self.H, self.W)
+        return dict(zip(self.agent_ids, belief))
+
+    def column(self, field):
+        """ A field over the whole episode as one (T, n_agents, ...) array, for analysis. """
+        return np.concatenate([self._chunk(i)[field] for i in range(len(self._files))]) \
+            if self._files else np.empty(0)
+
+    def replay(self, viz, steps_per_second=10, start=0, stop=None):
+        """
+        Feed the trace to a MapVisualizer at any speed, starting from any step.
+        Steps are paced by the clock, not by the frame rate: above the
+        visualizer's 60 fps cap several steps are shown per frame, below it
+        (down to fractions of a step per second) frames keep coming so the
+        window stays responsive.
+        Returns False if the window was closed.
+        """
+        import time
+        import pygame as pg
+
+        if steps_per_second <= 0:
+            raise ValueError(f"steps_per_second must be positive, got {steps_per_second}")
+        stop = self._len if stop is None else min(stop, self._len)
+        positions = self.column("positions")
+        trails = {aid: [tuple(p) for p in positions[:start, j].tolist()]
+                  for j, aid in enumerate(self.agent_ids)}
+        viz.set_fps(60)
+
+        shown, t0 = start, time.perf_counter()  # steps up to `shown` are on screen
+        while shown < stop:
+            due = min(stop, start + 1 + int((time.perf_counter() - t0) * steps_per_second))
+            for t in range(shown, due):
+                for j, aid in enumerate(self.agent_ids):
+                    trails[aid].append(tuple(positions[t, j].tolist()))
+            shown = max(shown, due)
+            viz.update_agents([(aid, trails[aid][-1]) for aid in self.agent_ids], trails=trails)
+            for event in pg.event.get():
+                if event.type == pg.QUIT:
+                    return False
+        return True
+
+
+class _TraceMapLoader:
+    """ Stands in for the DataLoader so MapVisualizer draws the map stored in the trace. """
+    def __init__(self, reader: TraceReader):
+        self.reader = reader
+
+    def load_data(self):
+        import pandas as pd  # MapVisualizer expects a DataFrame, like DataLoader gives it
+        return pd.DataFrame(self.reader.true_map)
+
+
+if __name__ == "__main__":
+    import sys
+    from Visualization_Map import MapVisualizer as MV
+
+    reader = TraceReader(sys.argv[1])
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    viz = MV(_TraceMapLoader(reader), cell_size=40)
+    # start and goals as recorded, the map itself may not carry the 2/3 markers
+    viz.agents = {aid: tuple(p) for aid, p in zip(reader.agent_ids, reader.start.tolist())}
+    viz.goals = {aid: tuple(p) for aid, p in zip(reader.agent_ids, reader.goals.tolist())}
+    viz.draw_map()
+    reader.replay(viz, steps_per_second=speed)
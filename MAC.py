@@ -1,56 +1,111 @@
-from Tree import TreeBuilder
+import time
+from Tree import TranspositionTable
 from BeliefStateManager import BeliefManager as BM
 from State_Manager import StateManager as SM
 from pomcp import POMCPAgent
 
 class MultiAgentController:
-    def __init__(self, state_mgr:SM, belief_mgr:BM, agent_ids, gamma=0.95, horizon=10):
+    def __init__(self, state_mgr:SM, belief_mgr:BM, agent_ids, gamma=0.95, horizon=10,
+                 transposition_size=0, transposition_policy="lru", keep_transpositions=False,
+                 widening=None, bucket_radius=None, max_nodes=None, max_tree_bytes=None, prune="visits",
+                 selection=None):
+        """
+        transposition_size: > 0 gives every agent a value cache of that many
+        (position, belief) entries (see Tree.TranspositionTable)
+        keep_transpositions: keep each cache across steps instead of per decision
+        widening: (k, alpha) progressive widening of observation nodes
+        bucket_radius: key observation nodes by the cells within this radius
+        (plus goal direction) instead of the full observation
+        max_nodes / max_tree_bytes: memory budget of every agent's tree
+        prune: what to do when it is reached, "visits" (drop the least visited
+        subtrees) or "stop" (stop expanding)
+        selection: tree policy shared by all agents, a SelectionPolicy, its name
+        ("ucb", "puct", "rave") or {"name": ..., **parameters}; default UCB
+        """
         self.state_mgr = state_mgr
         self.belief_mgr = belief_mgr
         self.agent_ids = agent_ids
         self.trails = {aid: [] for aid in agent_ids}
 
         self.agents = {
-            aid: POMCPAgent(aid, state_mgr, belief_mgr, gamma, horizon)
+            aid: POMCPAgent(aid, state_mgr, belief_mgr, gamma, horizon,
+                            transpositions=TranspositionTable(state_mgr.H, state_mgr.W, transposition_size,
+                                                              transposition_policy) if transposition_size > 0 else None,
+                            keep_transpositions=keep_transpositions,
+                            widening=widening, bucket_radius=bucket_radius,
+                            max_nodes=max_nodes, max_tree_bytes=max_tree_bytes, prune=prune,
+                            selection=selection)
             for aid in agent_ids}
 
         # local histories per agent
         self.histories = {aid: () for aid in agent_ids}
 
+        # planner stats of the last step: aid -> {"time", "nodes", "root_N", "bytes", "pruned", ...}
+        self.plan_stats = {}
 
-    def step(self, n_simulations=100):
+
+    def step(self, n_simulations=100, cancel=None):
+        """
+        cancel: optional threading.Event; if it gets set while planning, the
+        step is abandoned before touching the environment and None is returned.
+        """
         # 1. Each agent independently chooses its action
+        joint_action = self.plan(n_simulations, cancel)
+        if joint_action is None:
+            return None
+
+        # 2. Apply joint action in the real environment
+        #    (beliefs and particles are updated there from the real observations)
+        new_pos, observations, rewards = self.state_mgr.apply_actions_batched(joint_action)
+
+        # 3. Update each agent's local history and re-root its tree
+        self.advance(joint_action, observations)
+
+        return joint_action, observations, rewards
+
+    def plan(self, n_simulations=100, cancel=None):
+        """
+        Choose the joint action from the current beliefs, without acting.
+        Returns None if cancelled.
+        """
         joint_action = {}
         for aid, planner in self.agents.items():
-            a = planner.bestAction(n_simulations)
+            t0 = time.perf_counter()
+            a = planner.bestAction(n_simulations, cancel)
+            if cancel is not None and cancel.is_set():
+                return None
             joint_action[aid] = a
+            tree = planner.tree
+            self.plan_stats[aid] = {"time": time.perf_counter() - t0,
+                                    "root_N": tree.nodes[tree.root]["N"],
+                                    "pruned": tree.pruned,
+                                    **tree.stats()}
+        return joint_action
 
-        # 2. Apply joint action in the real environment
-        new_pos, observations, rewards = self.state_mgr.apply_actions(joint_action)
-        
+    def advance(self, joint_action, observations):
+        """
+        After the joint action was executed and observed (state_mgr already
+        updated): record trails, extend histories and re-root every tree.
+        """
         # Agent trails
         for aid in self.agent_ids:
             self.trails[aid].append(self.state_mgr.agent_pos[aid])
 
-        # 3. Update beliefs from real observations
-        for aid, obs in observations.items():
-            self.belief_mgr.update_belief(aid, obs)
-        # 4. Update each agent's local history and re-root its tree
         for aid in self.agent_ids:
+            planner = self.agents[aid]
             a = joint_action[aid]
-            o = observations[aid]
+            o = planner.observation_key(observations[aid], self.state_mgr.agent_pos[aid], self.state_mgr.true_map)
 
             # extend local history
             old_hist = self.histories[aid]
             new_hist = old_hist + (a, o)
             self.histories[aid] = new_hist
 
-            # re-root the agent's tree
-            tree = self.agents[aid].tree
-            if new_hist in tree.nodes:
-                tree.make_root(new_hist)
+            # re-root the agent's tree (tree histories are relative to its current root)
+            tree = planner.tree
+            child = tree.root + (a, o)
+            if child in tree.nodes:
+                tree.make_root(child)
             else:
                 # if not in tree, reset to empty
-                self.agents[aid].tree = TreeBuilder()
-
-        return joint_action, observations, rewards
+                self.agents[aid].tree = planner.new_tree()
@@ -0,0 +1,116 @@
+"""
+Background planning for run_episode.
+
+The planner runs in its own thread and publishes every completed step to a
+queue, so the pygame loop never waits on POMCP and the frame rate never
+throttles the planner.
+"""
+import queue
+import threading
+from MAC import MultiAgentController as MAC
+from State_Manager import StateManager as SM
+
+
+class PlannerWorker(threading.Thread):
+    def __init__(self, controller: MAC, state_mgr: SM, n_simulations=200, max_steps=50, trace=None,
+                 checkpointer=None, start_step=0):
+        super().__init__(daemon=True)
+        self.controller = controller
+        self.state_mgr = state_mgr
+        self.n_simulations = n_simulations
+        self.max_steps = max_steps
+        self.trace = trace  # optional EpisodeTrace.TraceWriter, fed from this thread
+        self.checkpointer = checkpointer  # optional Checkpoint.Checkpointer
+        self.start_step = start_step  # steps already done (resumed from a checkpoint)
+
+        # completed steps, consumed by the render loop:
+        #   ("step", t, joint_action, observations, rewards, positions)
+        #   ("done", t, all_at_goal)
+        #   ("error", exception)
+        self.steps = queue.Queue()
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()    # set while the worker is allowed to plan
+        self._cancel = threading.Event()  # set on quit, aborts in-flight planning
+        self._paused = False
+        self._budget = 0                  # single steps granted while paused
+        self._wake.set()
+
+    # -------------------------------------------------------
+    # 1. Controls (called from the render loop)
+    # -------------------------------------------------------
+    def pause(self):
+        with self._lock:
+            self._paused = True
+            self._budget = 0
+            self._wake.clear()
+
+    def resume(self):
+        with self._lock:
+            self._paused = False
+            self._budget = 0
+            self._wake.set()
+
+    def step_once(self):
+        """ While paused, allow exactly one more step to be planned. """
+        with self._lock:
+            self._budget += 1
+            self._wake.set()
+
+    def cancel(self, timeout=None):
+        """ Stop the worker, interrupting the step being planned, and wait for it. """
+        self._cancel.set()
+        self._wake.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    # -------------------------------------------------------
+    # 2. Planning loop
+    # -------------------------------------------------------
+    def _permit(self):
+        """ Block (without spinning) until the next step may be planned. False on cancel. """
+        while True:
+            self._wake.wait()
+            if self._cancel.is_set():
+                return False
+            with self._lock:
+                if not self._paused:
+                    return True
+                if self._budget > 0:
+                    self._budget -= 1
+                    if self._budget == 0:
+                        self._wake.clear()
+                    return True
+                self._wake.clear()
+
+    def run(self):
+        completed = self.start_step
+        try:
+            for t in range(self.start_step, self.max_steps):
+                if self.state_mgr.all_agents_at_goal():
+                    self.steps.put(("done", t, True))
+                    return
+                if not self._permit():
+                    return
+
+                result = self.controller.step(self.n_simulations, cancel=self._cancel)
+                if result is None:  # cancelled mid-planning, environment untouched
+                    return
+
+                joint_action, observations, rewards = result
+                completed = t + 1
+                if self.trace is not None:
+                    self.trace.record(joint_action, observations, rewards)
+                if self.checkpointer is not None:
+                    self.checkpointer.step(completed)
+                positions = dict(self.state_mgr.agent_pos)
+                self.steps.put(("step", t, joint_action, observations, rewards, positions))
+
+            self.steps.put(("done", self.max_steps, self.state_mgr.all_agents_at_goal()))
+        except Exception as e:
+            self.steps.put(("error", e))
+        finally:
+            if self.trace is not None:
+                self.trace.close()
+            if self.checkpointer is not None and completed > self.start_step:
+                self.checkpointer.step(completed, force=True)  # do not lose the steps since the last checkpoint
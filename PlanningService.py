@@ -0,0 +1,385 @@
+"""
+Planning service: a long-lived planner process for external environments.
+
+Instead of running against the in-process StateManager ground truth (main.py),
+the environment lives elsewhere and talks to the planner with JSON lines,
+over TCP or stdin/stdout. Every request carries an "id" that is echoed back.
+
+    {"id": 1, "op": "open", "session": "s1", "map_size": [H, W],
+     "agents": {"a": {"start": [r, c], "goal": [r, c]}, ...},
+     "gamma": 0.95, "horizon": 10, "n_simulations": 100, "planner": {...}}
+    {"id": 2, "op": "act", "session": "s1",
+     "observations": {"a": {"pos": [r, c], "cells": [[r, c, value], ...]}, ...}}
+        -> {"id": 2, "ok": true, "actions": {"a": "up", ...}}
+    {"id": 3, "op": "close", "session": "s1"}
+    {"id": 4, "op": "metrics"}
+
+"observations" is what the agents saw after the previous action (it can be
+left out on the first "act"). "planner" is passed to MultiAgentController
+(transposition_size, widening, bucket_radius, selection, ...).
+
+Sessions keep their trees and beliefs warm between requests. Each session is
+pinned to one worker (a single-process pool, the least loaded when the
+session is opened), and requests waiting for the same worker are handed
+over together as one batch.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import sys
+import time
+import zlib
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from BeliefStateManager import BeliefManager as BM
+from State_Manager import StateManager as SM, OBS_RADIUS
+from MAC import MultiAgentController as MAC
+
+
+# -------------------------------------------------------
+# 1. Sessions (live inside a worker)
+# -------------------------------------------------------
+class PlanningSession:
+    def __init__(self, map_size, agents, gamma=0.95, horizon=10, n_simulations=100, planner=None):
+        H, W = map_size
+        known_map = np.zeros((H, W), dtype=int)  # filled in from the observations
+        starts = {aid: tuple(a["start"]) for aid, a in agents.items()}
+        goals = {aid: tuple(a["goal"]) for aid, a in agents.items()}
+
+        self.belief_mgr = BM(known_map, list(agents))
+        self.state_mgr = SM(known_map, starts, goals, self.belief_mgr)
+        self.controller = MAC(self.state_mgr, self.belief_mgr, list(agents), gamma, horizon, **(planner or {}))
+        self.n_simulations = n_simulations
+        self.last_action = None
+
+    def act(self, observations=None):
+        if observations:
+            positions, windows = {}, {}
+            for aid in self.controller.agent_ids:
+                cells = np.asarray(observations[aid].get("cells", []), dtype=int).reshape(-1, 3)
+                positions[aid] = observations[aid]["pos"]
+                windows[aid] = (cells[:, 0], cells[:, 1], cells[:, 2])
+            obs = self.state_mgr.apply_observations(positions, windows)
+            if self.last_action is not None:
+                self.controller.advance(self.last_action, obs)
+
+        self.last_action = self.controller.plan(self.n_simulations)
+        return {aid: str(a) for aid, a in self.last_action.items()}
+
+
+_SESSIONS = {}  # session id -> PlanningSession, per worker
+
+
+def _dispatch(req):
+    op = req["op"]
+    if op == "open":
+        _SESSIONS[req["session"]] = PlanningSession(
+            req["map_size"], req["agents"], req.get("gamma", 0.95), req.get("horizon", 10),
+            req.get("n_simulations", 100), req.get("planner"))
+        return {"session": req["session"]}
+    if op == "act":
+        if req["session"] not in _SESSIONS:
+            raise KeyError(f"unknown session {req['session']!r}")
+        return {"actions": _SESSIONS[req["session"]].act(req.get("observations"))}
+    if op == "close":
+        _SESSIONS.pop(req["session"], None)
+        return {}
+    raise ValueError(f"unknown op {op!r}")
+
+
+def _handle_batch(batch):
+    """ Run a batch of requests, in order, inside one worker. """
+    results = []
+    for req in batch:
+        try:
+            results.append({"ok": True, **_dispatch(req)})
+        except Exception as e:
+            results.append({"ok": False, "error": f"{type(e).__name__}: {e}"})
+    return results
+
+
+# -------------------------------------------------------
+# 2. Metrics
+# -------------------------------------------------------
+class ServiceMetrics:
+    def __init__(self, window=1000):
+        self.started = time.perf_counter()
+        self.requests = Counter()  # op -> count
+        self.errors = 0
+        self.latencies = deque(maxlen=window)  # seconds, most recent requests
+        self.finished = deque(maxlen=window)   # completion times, for the recent rate
+        self.batch_sizes = deque(maxlen=window)
+
+    def record(self, op, latency, ok):
+        self.requests[op] += 1
+        self.errors += not ok
+        self.latencies.append(latency)
+        self.finished.append(time.perf_counter())
+
+    def snapshot(self):
+        now = time.perf_counter()
+        lat = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        recent = len(self.finished) / (now - self.finished[0]) if len(self.finished) > 1 else 0.0
+        return {
+            "uptime_s": now - self.started,
+            "requests": dict(self.requests),
+            "errors": self.errors,
+            "throughput_rps": sum(self.requests.values()) / (now - self.started),
+            "recent_rps": recent,
+            "latency_ms": {"mean": float(lat.mean()), "p50": float(np.percentile(lat, 50)),
+                           "p95": float(np.percentile(lat, 95)), "p99": float(np.percentile(lat, 99)),
+                           "max": float(lat.max())},
+            "mean_batch": float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+        }
+
+
+# -------------------------------------------------------
+# 3. Server
+# -------------------------------------------------------
+class PlanningServer:
+    def __init__(self, workers=2, processes=True, max_batch=32):
+        """
+        workers: number of planner workers, sessions are spread over them
+        processes: one process per worker (planning is CPU bound); threads otherwise
+        max_batch: most requests handed to a worker at once
+        """
+        if processes:
+            # spawn, not fork: forking next to the other pools' threads can deadlock
+            ctx = multiprocessing.get_context("spawn")
+            self.pools = [ProcessPoolExecutor(max_workers=1, mp_context=ctx) for _ in range(workers)]
+        else:
+            self.pools = [ThreadPoolExecutor(max_workers=1) for _ in range(workers)]
+        self.max_batch = max_batch
+        self.metrics = ServiceMetrics()
+        self._queues = None
+        self._tasks = []
+        self._connections = set()
+        self._placement = {}  # session -> worker, chosen when the session is opened
+
+    def _worker_of(self, req):
+        session = req["session"]
+        if session not in self._placement:
+            if req.get("op") != "open":  # never opened here: any worker answers "unknown session"
+                return zlib.crc32(str(session).encode()) % len(self.pools)
+            load = Counter(self._placement.values())
+            self._placement[session] = min(range(len(self.pools)), key=lambda w: load[w])
+        worker = self._placement[session]
+        if req.get("op") == "close":
+            del self._placement[session]
+        return worker
+
+    async def start(self):
+        self._queues = [asyncio.Queue() for _ in self.pools]
+        self._tasks = [asyncio.create_task(self._worker_loop(w)) for w in range(len(self.pools))]
+
+    async def stop(self):
+        await asyncio.gather(*self._connections, return_exceptions=True)  # let open streams finish
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for pool in self.pools:
+            pool.shutdown(cancel_futures=True)
+
+    async def handle(self, req):
+        """ Answer one request (a dict); the response echoes its id. """
+        if not isinstance(req, dict):
+            return {"ok": False, "error": f"bad request: expected a JSON object, got {type(req).__name__}"}
+        t0 = time.perf_counter()
+        if req.get("op") == "metrics":
+            res = {"ok": True, "metrics": self.metrics.snapshot()}
+        elif "session" not in req:
+            res = {"ok": False, "error": "request needs a session"}
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            await self._queues[self._worker_of(req)].put((req, fut))
+            res = await fut
+        self.metrics.record(req.get("op"), time.perf_counter() - t0, res["ok"])
+        if "id" in req:
+            res["id"] = req["id"]
+        return res
+
+    async def _worker_loop(self, w):
+        """ Hand everything waiting for worker w over as one batch, one batch at a time. """
+        loop = asyncio.get_running_loop()
+        queue = self._queues[w]
+        while True:
+            items = [await queue.get()]
+            while len(items) < self.max_batch and not queue.empty():
+                items.append(queue.get_nowait())
+            self.metrics.batch_sizes.append(len(items))
+            try:
+                results = await loop.run_in_executor(self.pools[w], _handle_batch, [req for req, _ in items])
+            except Exception as e:  # worker died
+                results = [{"ok": False, "error": f"{type(e).__name__}: {e}"}] * len(items)
+            for (_, fut), res in zip(items, results):
+                if not fut.done():
+                    fut.set_result(res)
+
+    async def serve_stream(self, reader, writer):
+        """ JSON lines in, JSON lines out; requests on one stream are answered concurrently. """
+        lock = asyncio.Lock()
+        pending = set()
+        self._connections.add(asyncio.current_task())
+
+        async def respond(line):
+            # every line gets an answer, a client waiting on its id must never hang
+            req = None
+            try:
+                req = json.loads(line)
+                res = await self.handle(req)
+            except (ValueError, TypeError) as e:
+                res = {"ok": False, "error": f"bad request: {e}"}
+            except Exception as e:
+                res = {"ok": False, "error": f"internal error: {type(e).__name__}: {e}"}
+            if isinstance(req, dict) and "id" in req:
+                res["id"] = req["id"]
+            async with lock:
+                writer.write((json.dumps(res) + "\n").encode())
+                await writer.drain()
+
+        while line := await reader.readline():
+            if line.strip():
+                task = asyncio.create_task(respond(line))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        await asyncio.gather(*pending)
+        self._connections.discard(asyncio.current_task())
+
+    async def serve_tcp(self, host="127.0.0.1", port=8765):
+        await self.start()
+        server = await asyncio.start_server(self.serve_stream, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def serve_stdio(self):
+        await self.start()
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout)
+        writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+        try:
+            await self.serve_stream(reader, writer)
+        finally:
+            await self.stop()
+
+
+# -------------------------------------------------------
+# 4. Client and stand-in environment (local testing)
+# -------------------------------------------------------
+class PlanningClient:
+    """ asyncio JSON-lines client; several requests may be in flight at once. """
+    def __init__(self, reader, writer):
+        self.reader, self.writer = reader, writer
+        self._next_id = 0
+        self._pending = {}
+        self._reader_task = asyncio.create_task(self._read())
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=8765):
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def _read(self):
+        while line := await self.reader.readline():
+            res = json.loads(line)
+            fut = self._pending.pop(res.get("id"), None)
+            if fut is not None:
+                fut.set_result(res)
+
+    async def request(self, op, **fields):
+        self._next_id += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[self._next_id] = fut
+        self.writer.write((json.dumps({"id": self._next_id, "op": op, **fields}) + "\n").encode())
+        await self.writer.drain()
+        res = await fut
+        if not res["ok"]:
+            raise RuntimeError(res["error"])
+        return res
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self._reader_task.cancel()
+
+
+class StandInEnvironment:
+    """ Ground truth for local testing: moves the agents on a known grid and reports what they see. """
+    def __init__(self, true_map, starts, goals, radius=OBS_RADIUS):
+        self.radius = radius
+        self.state_mgr = SM(true_map, starts, goals, BM(true_map, list(starts)))
+
+    def observe(self):
+        out = {}
+        sm = self.state_mgr
+        for aid, (r, c) in sm.agent_pos.items():
+            rows, cols = sm._window(r, c, sm.H, sm.W, self.radius)
+            out[aid] = {"pos": [int(r), int(c)],
+                        "cells": np.stack([rows, cols, sm.true_map[rows, cols]], axis=1).tolist()}
+        return out
+
+    def step(self, actions):
+        self.state_mgr.agent_pos.update(self.state_mgr.transition_model(actions))
+        return self.observe()
+
+    def done(self):
+        return self.state_mgr.all_agents_at_goal()
+
+
+async def run_demo(map_path="MAP_KRR.xlsx", sessions=4, steps=20, workers=2, n_simulations=30, horizon=3):
+    """ Serve on a local port and drive `sessions` stand-in environments against it concurrently. """
+    from DataLoading import DataLoader as DL
+
+    grid = DL(map_path).load_data().to_numpy(dtype=int)
+    starts = {str(i + 1): tuple(int(x) for x in p) for i, p in enumerate(np.argwhere(grid == 2))}
+    goals = {str(i + 1): tuple(int(x) for x in p) for i, p in enumerate(np.argwhere(grid == 3))}
+
+    server = PlanningServer(workers=workers)
+    await server.start()
+    tcp = await asyncio.start_server(server.serve_stream, "127.0.0.1", 0)
+    port = tcp.sockets[0].getsockname()[1]
+
+    async def episode(k):
+        client = await PlanningClient.connect("127.0.0.1", port)
+        env = StandInEnvironment(grid, starts, goals)
+        sid = f"demo-{k}"
+        await client.request("open", session=sid, map_size=list(grid.shape),
+                             agents={aid: {"start": starts[aid], "goal": goals[aid]} for aid in starts},
+                             horizon=horizon, n_simulations=n_simulations)
+        obs = env.observe()
+        for _ in range(steps):
+            actions = (await client.request("act", session=sid, observations=obs))["actions"]
+            obs = env.step(actions)
+            if env.done():
+                break
+        await client.request("close", session=sid)
+        await client.close()
+        return env.state_mgr.agent_pos
+
+    final = await asyncio.gather(*(episode(k) for k in range(sessions)))
+    tcp.close()
+    await server.stop()
+    return final, server.metrics.snapshot()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="POMCP planning service")
+    parser.add_argument("--tcp", help="host:port to listen on (default: stdin/stdout)")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", action="store_true", help="thread workers instead of processes")
+    parser.add_argument("--demo", action="store_true", help="run stand-in environments against a local server")
+    args = parser.parse_args()
+
+    if args.demo:
+        final, metrics = asyncio.run(run_demo(workers=args.workers))
+        print("Final positions:", final)
+        print(json.dumps(metrics, indent=2))
+    else:
+        server = PlanningServer(workers=args.workers, processes=not args.threads)
+        if args.tcp:
+            host, port = args.tcp.rsplit(":", 1)
+            asyncio.run(server.serve_tcp(host, int(port)))
+        else:
+            asyncio.run(server.serve_stdio())
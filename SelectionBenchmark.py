@@ -0,0 +1,72 @@
+"""
+Selection policy benchmark: decisions to reach the goal per simulation budget.
+
+For every policy and budget (simulations per decision) a few seeded episodes
+are run on the map, headless, and the table reports per agent:
+    steps     mean decisions until the agent first reached its goal
+              (agents that never did count as max_steps)
+    reached   fraction of agents that reached their goal
+    ms/dec    mean planning time per decision of one agent
+
+    python SelectionBenchmark.py --policies ucb puct rave --budgets 5 22 50 --seeds 3
+"""
+import argparse
+import time
+import numpy as np
+from DataLoading import DataLoader as DL
+from BeliefStateManager import BeliefManager as BM
+from State_Manager import StateManager as SM
+from MAC import MultiAgentController as MAC
+
+
+def run_episode(grid, policy, n_simulations, seed, max_steps=150, gamma=0.99, horizon=3):
+    """ One headless episode. Returns ({agent_id: steps to goal or None}, seconds per decision). """
+    agents = {i + 1: tuple(int(x) for x in p) for i, p in enumerate(np.argwhere(grid == 2))}
+    goals = {i + 1: tuple(int(x) for x in p) for i, p in enumerate(np.argwhere(grid == 3))}
+    np.random.seed(seed)
+    belief_mgr = BM(grid, list(agents))
+    state_mgr = SM(grid, agents, goals, belief_mgr)
+    controller = MAC(state_mgr, belief_mgr, list(agents), gamma=gamma, horizon=horizon, selection=policy)
+
+    reached = {aid: None for aid in agents}
+    plan_time, decisions = 0.0, 0
+    for t in range(max_steps):
+        controller.step(n_simulations)
+        plan_time += sum(stats["time"] for stats in controller.plan_stats.values())
+        decisions += len(agents)
+        for aid in agents:
+            if reached[aid] is None and state_mgr.agent_pos[aid] == goals[aid]:
+                reached[aid] = t + 1
+        if all(steps is not None for steps in reached.values()):
+            break
+    return reached, plan_time / decisions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--policies", nargs="+", default=["ucb", "puct", "rave"])
+    parser.add_argument("--budgets", nargs="+", type=int, default=[5, 22, 50])
+    parser.add_argument("--seeds", type=int, default=3)
+    parser.add_argument("--max-steps", type=int, default=150)
+    parser.add_argument("--horizon", type=int, default=3)
+    parser.add_argument("--map", default="MAP_KRR.xlsx")
+    args = parser.parse_args()
+
+    grid = DL(args.map).load_data().to_numpy(dtype=int)
+    print(f"{'policy':>8} {'budget':>7} {'steps':>7} {'reached':>8} {'ms/dec':>8}")
+    for policy in args.policies:
+        for budget in args.budgets:
+            t0 = time.perf_counter()
+            steps, per_decision = [], []
+            for seed in range(args.seeds):
+                reached, spd = run_episode(grid, policy, budget, seed, args.max_steps, horizon=args.horizon)
+                steps.extend(reached.values())
+                per_decision.append(spd)
+            mean_steps = np.mean([args.max_steps if s is None else s for s in steps])
+            success = np.mean([s is not None for s in steps])
+            print(f"{policy:>8} {budget:>7} {mean_steps:7.1f} {success:8.0%} {1000 * np.mean(per_decision):8.1f}"
+                  f"   ({time.perf_counter() - t0:.0f} s)", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Tree policies for POMCPAgent: how a history node picks the action to descend.
+
+    UCBSelection   untried actions first (goal-greedy one before the others),
+                   then UCB. The original POMCPAgent behaviour and the default.
+    PUCTSelection  PUCT, with priors from the goal distance of every action.
+    RAVESelection  UCB blended with AMAF (all-moves-as-first) values, shared
+                   between the actions of a node from every action taken later
+                   in the same simulation, rollouts included.
+
+A policy only holds its parameters, so one instance can be shared by all agents.
+Per-node data (priors, AMAF stats) is kept in the node dicts themselves.
+"""
+import math
+import numpy as np
+from Tree import UCB
+
+
+class SelectionPolicy:
+    # True if backup() needs the actions taken below each node
+    uses_trace = False
+
+    def select(self, agent, state, node):
+        """ Action to take at history node `node` for simulated state `state`. """
+        raise NotImplementedError
+
+    def backup(self, node, actions, G):
+        """
+        Called after `node` was backed up with return G, with the actions this
+        agent took from it to the end of the simulation (if uses_trace).
+        """
+        pass
+
+    def _untried(self, agent, state, node):
+        """ Untried action, the goal-greedy one if it is untried, None if all were tried. """
+        children = node["children"]
+        untried = [a for a in agent.actions if a not in children]
+        if not untried:
+            return None
+        a = agent._greedy_goal_action(state)
+        if a in untried:
+            return a
+        return np.random.choice(untried)
+
+
+class UCBSelection(SelectionPolicy):
+    def __init__(self, c=3.0):
+        self.c = c
+
+    def select(self, agent, state, node):
+        # explore untried actions first
+        a = self._untried(agent, state, node)
+        if a is not None:
+            return a
+
+        # otherwise use UCB
+        children = node["children"]
+        N = node["N"]
+        best_a, best_score = None, -float("inf")
+        for a in agent.actions:
+            a_node = agent.tree.nodes[children[a]]
+            score = UCB(N, a_node["N"], a_node["V"], c=self.c)
+            if score > best_score:
+                best_score = score
+                best_a = a
+        return best_a
+
+
+class PUCTSelection(SelectionPolicy):
+    def __init__(self, c=3.0, temperature=3.0):
+        """
+        c: exploration constant
+        temperature: of the prior softmax over -goal distance; lower makes
+        the prior greedier (on maze-like maps Manhattan distance misleads,
+        keep it flat)
+        """
+        self.c = c
+        self.temperature = temperature
+
+    def priors(self, agent, state):
+        d = agent.goal_distances(state)
+        x = -np.array([d[a] for a in agent.actions], dtype=float) / self.temperature
+        p = np.exp(x - x.max())
+        return dict(zip(agent.actions, p / p.sum()))
+
+    def select(self, agent, state, node):
+        if "P" not in node:  # priors from the state of the first visit
+            node["P"] = self.priors(agent, state)
+        P = node["P"]
+        children = node["children"]
+        sqrt_N = math.sqrt(node["N"])
+        best_a, best_score = None, -float("inf")
+        for a in agent.actions:
+            if a in children:
+                a_node = agent.tree.nodes[children[a]]
+                n, V = a_node["N"], a_node["V"]
+            else:
+                n, V = 0, 0.0
+            score = V + self.c * P[a] * sqrt_N / (1 + n)
+            if score > best_score:
+                best_score = score
+                best_a = a
+        return best_a
+
+
+class RAVESelection(SelectionPolicy):
+    uses_trace = True
+
+    def __init__(self, c=1.0, equivalence=50):
+        """
+        c: exploration constant (AMAF values already explore, keep it small)
+        equivalence: visit count at which the node's own value and the AMAF
+        value weigh the same, beta = sqrt(k / (3N + k))
+        """
+        self.c = c
+        self.equivalence = equivalence
+
+    def select(self, agent, state, node):
+        amaf = node.get("amaf", {})
+        children = node["children"]
+        if not amaf:
+            a = self._untried(agent, state, node)
+            if a is not None:
+                return a
+
+        N = node["N"]
+        log_N = math.log(max(N, 1))
+        beta = math.sqrt(self.equivalence / (3 * N + self.equivalence))
+        best_a, best_score = None, -float("inf")
+        for a in agent.actions:
+            if a in children:
+                a_node = agent.tree.nodes[children[a]]
+                n, V = a_node["N"], a_node["V"]
+            else:
+                n, V = 0, 0.0
+            if a in amaf:
+                _, amaf_V = amaf[a]
+                q = (1 - beta) * V + beta * amaf_V if n else amaf_V
+            elif n:
+                q = V
+            else:
+                return self._untried(agent, state, node)  # never seen, try it first
+            score = q + self.c * math.sqrt(log_N / (n + 1))
+            if score > best_score:
+                best_score = score
+                best_a = a
+        return best_a
+
+    def backup(self, node, actions, G):
+        amaf = node.setdefault("amaf", {})
+        for a in set(actions):
+            n, V = amaf.get(a, (0, 0.0))
+            amaf[a] = (n + 1, V + (G - V) / (n + 1))
+
+
+POLICIES = {"ucb": UCBSelection, "puct": PUCTSelection, "rave": RAVESelection}
+
+
+def make_policy(spec=None):
+    """
+    Selection policy from a SelectionPolicy, a name ("ucb", "puct", "rave"),
+    or a dict {"name": ..., **parameters} (as sent to the planning service).
+    None gives the default UCBSelection().
+    """
+    if spec is None:
+        return UCBSelection()
+    if isinstance(spec, SelectionPolicy):
+        return spec
+    if isinstance(spec, str):
+        spec = {"name": spec}
+    params = dict(spec)
+    name = params.pop("name")
+    if name not in POLICIES:
+        raise ValueError(f"unknown selection policy {name!r}, expected one of {sorted(POLICIES)}")
+    return POLICIES[name](**params)
@@ -0,0 +1,84 @@
+"""
+Startup benchmark for the planning core.
+
+Every run starts a fresh interpreter (like a new batch or service worker) and
+measures:
+    import     importing pomcp, Tree, MAC, State_Manager and BeliefStateManager
+    decision   building the managers and planning the first joint action
+    process    wall time of the whole interpreter, startup and exit included
+
+It also checks that the core stays NumPy only: if importing it loads pandas,
+scipy or pygame the benchmark reports them and exits with status 1.
+
+    python StartupBenchmark.py --runs 5 --simulations 100 --horizon 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY = ("pandas", "scipy", "pygame")
+
+# runs in the fresh interpreter, the map comes in on stdin
+_CHILD = """
+import json, sys, time
+t0 = time.perf_counter()
+import numpy as np
+import Tree, pomcp, MAC, State_Manager, BeliefStateManager
+t1 = time.perf_counter()
+heavy = [m for m in {heavy!r} if m in sys.modules]
+
+args = json.loads(sys.stdin.read())
+grid = np.array(args["grid"], dtype=int)
+agents = {{i + 1: tuple(int(x) for x in p) for i, p in enumerate(np.argwhere(grid == 2))}}
+goals = {{i + 1: tuple(int(x) for x in p) for i, p in enumerate(np.argwhere(grid == 3))}}
+np.random.seed(0)
+bm = BeliefStateManager.BeliefManager(grid, list(agents))
+sm = State_Manager.StateManager(grid, agents, goals, bm)
+controller = MAC.MultiAgentController(sm, bm, list(agents), horizon=args["horizon"])
+controller.plan(args["simulations"])
+t2 = time.perf_counter()
+print(json.dumps({{"import": t1 - t0, "decision": t2 - t1, "heavy": heavy}}))
+"""
+
+
+def run_once(grid, simulations, horizon):
+    code = _CHILD.format(heavy=HEAVY)
+    t0 = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                         input=json.dumps({"grid": grid, "simulations": simulations, "horizon": horizon}),
+                         capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["process"] = time.perf_counter() - t0
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--simulations", type=int, default=100)
+    parser.add_argument("--horizon", type=int, default=10)
+    parser.add_argument("--map", default="MAP_KRR.xlsx")
+    args = parser.parse_args()
+
+    from DataLoading import DataLoader as DL  # pandas, only in this process
+    grid = DL(args.map).load_data().to_numpy(dtype=int).tolist()
+
+    results = [run_once(grid, args.simulations, args.horizon) for _ in range(args.runs)]
+    for field in ("import", "decision", "process"):
+        values = [r[field] * 1000 for r in results]
+        print(f"{field:>8}: median {statistics.median(values):8.1f} ms   "
+              f"min {min(values):8.1f} ms   max {max(values):8.1f} ms")
+
+    heavy = sorted({m for r in results for m in r["heavy"]})
+    if heavy:
+        print("core import loaded:", ", ".join(heavy))
+        sys.exit(1)
+    print("core import is NumPy only")
+
+
+if __name__ == "__main__":
+    main()
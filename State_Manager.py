@@ -1,11 +1,30 @@
+import math
 import numpy as np
 from BeliefStateManager import BeliefManager
-from scipy.stats import entropy
+
+OBS_RADIUS = 2 # Manhattan radius of what an agent observes around itself
+
+def _binary_entropy(p):
+    """
+    Entropy (nats) of [p, 1 - p], computed the way scipy.stats.entropy does
+    (normalize, then sum -x*log(x)). math.log matches scipy's log bit for bit,
+    np.log does not always.
+    """
+    q = 1 - p
+    s = p + q
+    p, q = p / s, q / s
+    return -(p * math.log(p)) + -(q * math.log(q))
 
 def belief_entropy(belief_map):
     eps = 1e-6
     p = np.clip(belief_map, eps, 1 - eps)
-    return entropy([p.mean(), 1 - p.mean()])
+    return _binary_entropy(p.mean())
+
+def belief_entropy_batch(belief_maps):
+    """ belief_entropy() for a stack of (n, H, W) belief maps at once. """
+    eps = 1e-6
+    p = np.clip(belief_maps, eps, 1 - eps).mean(axis=(1, 2))
+    return np.array([_binary_entropy(x) for x in p])
 
 def manhattan(pos1, pos2):
     return abs(pos1[0] - pos2[0]) + abs(pos1[1] - pos2[1])
@@ -31,32 +50,104 @@ class StateManager:
         self.success_prob = 1.0
         self.fail_prob = 0.0
 
+        self._offsets = {}      # radius -> (drow, dcol) arrays of the observation window
+        self._cell_orders = {}  # (H, W) -> key order of the observation tuple
+
     # -------------------------------------------------------
     # 1. OBSERVATION MODEL(what the agent can see)
     # -------------------------------------------------------
-    def observation(self, agent_id, position, map_grid, belief_map, H, W, radius=2):
+    def observation(self, agent_id, position, map_grid, belief_map, H, W, radius=OBS_RADIUS):
         """
         Agent observes cells in a given radius (usually 1 step around).
         Returns a hashable tuple for POMCP.
         """
 
+        cells = self.observed_cells(position, map_grid, belief_map, H, W, radius)
+        return self._observation_tuple(agent_id, position, cells)
+
+    def observed_cells(self, position, map_grid, belief_map, H, W, radius=OBS_RADIUS):
+        """ The (H, W) grid of cell values behind observation(), before it is turned into a tuple. """
+        row, col = position
+        cells = np.asarray(belief_map).astype(int)  # outside the radius: what the agent already believes
+        rows, cols = self._window(row, col, H, W, radius)
+        cells[rows, cols] = map_grid[rows, cols]
+        return cells
+
+    def local_signature(self, agent_id, position, map_grid, radius=1):
+        """
+        Coarse version of observation(): only the cells inside the radius
+        (usually smaller than the observation radius) and the goal direction,
+        without the belief-derived cells outside it.
+        Used to bucket observations in the search tree.
+        """
+        row, col = position
+        rows, cols = self._window(row, col, self.H, self.W, radius)
+        goal = self.goal_pos[agent_id]
+        return (tuple(map_grid[rows, cols].tolist()),
+                (int(np.sign(goal[0] - row)), int(np.sign(goal[1] - col))))
+
+    def _radius_offsets(self, radius):
+        """
+        (drow, dcol) offsets of every cell within Manhattan distance `radius`,
+        computed once per radius and reused by every observation.
+        """
+        if radius not in self._offsets:
+            d = np.arange(-radius, radius + 1)
+            drow, dcol = np.meshgrid(d, d, indexing="ij")
+            mask = np.abs(drow) + np.abs(dcol) <= radius
+            self._offsets[radius] = (drow[mask], dcol[mask])
+        return self._offsets[radius]
+
+    def _window(self, row, col, H, W, radius):
+        """ In-bounds (rows, cols) of the observation window around (row, col). """
+        drow, dcol = self._radius_offsets(radius)
+        rows, cols = row + drow, col + dcol
+        valid = (rows >= 0) & (rows < H) & (cols >= 0) & (cols < W)
+        return rows[valid], cols[valid]
+
+    def _cell_order(self, H, W):
+        """
+        Cell keys and flat indices in the order observation() has always used
+        (sorted by str(key)), plus the slot of the ("goal_dir",) entry.
+        """
+        if (H, W) not in self._cell_orders:
+            keys = [(r, c) for r in range(H) for c in range(W)] + [("goal_dir",)]
+            order = sorted(range(len(keys)), key=lambda i: str(keys[i]))
+            goal_slot = order.index(H * W)
+            order.remove(H * W)
+            self._cell_orders[(H, W)] = ([keys[i] for i in order], np.array(order), goal_slot)
+        return self._cell_orders[(H, W)]
+
+    def _observation_tuple(self, agent_id, position, cells):
+        """ Build the hashable observation from an (H, W) grid of observed cell values. """
+        H, W = cells.shape
+        keys, order, goal_slot = self._cell_order(H, W)
+        items = list(zip(keys, cells.ravel()[order].tolist()))
+
         row, col = position
-        observed_cells = {}
-        for drow in range(H):
-            for dcol in range(W):
-                dist = abs(drow - row) + abs(dcol - col)
-                if dist <= radius: 
-                    observed_cells[(drow, dcol)] = int(map_grid[drow, dcol]) 
-                else: 
-                    observed_cells[(drow, dcol)] = int(belief_map[drow, dcol])
         goal = self.goal_pos[agent_id]
         dx = np.sign(goal[0] - row)
         dy = np.sign(goal[1] - col)
-        observed_cells[("goal_dir",)] = (int(dx), int(dy))
+        items.insert(goal_slot, (("goal_dir",), (int(dx), int(dy))))
 
-        return tuple(sorted(observed_cells.items(), key=lambda x: str(x[0])))
+        return tuple(items)
+
+    def pack_observation(self, obs):
+        """
+        Compact form of an observation tuple: its cell values (in tuple order)
+        as an int8 array, and the goal direction. Inverse of unpack_observation().
+        """
+        _, _, goal_slot = self._cell_order(self.H, self.W)
+        values = [v for _, v in obs]
+        goal_dir = values.pop(goal_slot)
+        return np.array(values, dtype=np.int8), goal_dir
+
+    def unpack_observation(self, values, goal_dir):
+        keys, _, goal_slot = self._cell_order(self.H, self.W)
+        items = list(zip(keys, np.asarray(values).tolist()))
+        items.insert(goal_slot, (("goal_dir",), (int(goal_dir[0]), int(goal_dir[1]))))
+        return tuple(items)
 
-    
     # -------------------------------------------------------
     # 2. TRANSITION MODEL (movement uncertainty)
     # -------------------------------------------------------
@@ -216,7 +307,7 @@ class StateManager:
 
         # Get observations and update beliefs
         for agent_id in action_dict.keys():
-            obs = self.observation(agent_id, new_positions[agent_id], self.true_map, self.belief_mgr.belief[agent_id], self.H, self.W, radius=2)
+            obs = self.observation(agent_id, new_positions[agent_id], self.true_map, self.belief_mgr.belief[agent_id], self.H, self.W, radius=OBS_RADIUS)
             observations[agent_id]  = obs
             self.belief_mgr.update_belief(agent_id, obs)
 
@@ -231,6 +322,119 @@ class StateManager:
 
         return new_positions, observations, rewards
 
+    def apply_actions_batched(self, action_dict, radius=OBS_RADIUS):
+        """
+        Same step as apply_actions(), computed for all agents at once:
+        one gather from the true map for every observation window, one
+        belief write and one particle resample for all agents, and the
+        rewards as arrays.
+        Returns:
+            new_positions
+            true_observations
+            rewards
+        """
+        agent_ids = list(action_dict.keys())
+        actions = np.array([str(action_dict[aid]) for aid in agent_ids])
+        old_pos = np.array([self.agent_pos[aid] for aid in agent_ids])
+        goals = np.array([self.goal_pos[aid] for aid in agent_ids])
+        beliefs = np.stack([self.belief_mgr.belief[aid] for aid in agent_ids])  # (n, H, W)
+        old_entropy = belief_entropy_batch(beliefs)
+
+        # Apply actions
+        new_positions = self.transition_model(action_dict)  # joint transition
+        new_pos = np.array([new_positions[aid] for aid in agent_ids])
+
+        # Observation windows of all agents: one gather from the true map
+        drow, dcol = self._radius_offsets(radius)
+        rows = new_pos[:, :1] + drow  # (n, K)
+        cols = new_pos[:, 1:] + dcol
+        agent, k = np.nonzero((rows >= 0) & (rows < self.H) & (cols >= 0) & (cols < self.W))
+        rows, cols = rows[agent, k], cols[agent, k]
+        seen = self.true_map[rows, cols]
+
+        cells = beliefs.astype(int)  # outside the window: what each agent already believes
+        cells[agent, rows, cols] = seen
+
+        # Belief writes (same softening as BeliefManager.update_belief)
+        next_beliefs = np.where(cells == 0, 0.1, 0.9)
+        self.belief_mgr.set_beliefs(agent_ids, next_beliefs)
+
+        observations = {
+            aid: self._observation_tuple(aid, new_positions[aid], cells[i])
+            for i, aid in enumerate(agent_ids)
+        }
+
+        # Update positions
+        for aid in agent_ids:
+            self.agent_pos[aid] = new_positions[aid]
+            self.visited[aid].add(new_positions[aid])  # mark as visited
+
+        # Rewards (see reward())
+        old_d = np.abs(old_pos - goals).sum(axis=1)
+        new_d = np.abs(new_pos - goals).sum(axis=1)
+        blocked = (new_pos == old_pos).all(axis=1)
+        revisit = np.array([new_positions[aid] in self.visited[aid] for aid in agent_ids])
+
+        r_env = np.full(len(agent_ids), -0.1)
+        r_env += 100 * (new_d == 0)
+        r_env -= 1 * ((actions != 'stay') & blocked)
+        r_env -= 0.5 * revisit
+        r_env -= 0.5 * (actions == 'stay')
+
+        discount_factor = 0.90
+        r_pbrs = discount_factor * (-1 / (1 + new_d)) - (-1 / (1 + old_d))
+
+        r_info = np.clip(old_entropy - belief_entropy_batch(next_beliefs), -1.0, 1.0)
+
+        rewards = dict(zip(agent_ids, (r_env + r_pbrs + r_info).tolist()))
+        return new_positions, observations, rewards
+
+    def apply_observations(self, positions, windows):
+        """
+        Real step reported by an external environment instead of simulated
+        against true_map (see PlanningService).
+        positions: {agent_id: (row, col)} after the joint action
+        windows: {agent_id: (rows, cols, values)} cells each agent observed
+        Positions, visited cells, beliefs and particles are updated like in
+        apply_actions_batched(), and the observed cells are written into
+        true_map, which then holds the last known value of every cell.
+        Raises ValueError (before changing anything) for a position or cell
+        outside the grid, or a cell value other than 0 (free) / 1 (obstacle):
+        negative indices would otherwise silently wrap around.
+        Returns: true_observations
+        """
+        agent_ids = list(positions.keys())
+        windows = {aid: tuple(np.asarray(x, dtype=int).ravel() for x in windows[aid]) for aid in agent_ids}
+        for aid in agent_ids:
+            pos = positions[aid]
+            if len(pos) != 2 or not (0 <= pos[0] < self.H and 0 <= pos[1] < self.W):
+                raise ValueError(f"agent {aid}: position {list(pos)} outside the {self.H}x{self.W} grid")
+            rows, cols, values = windows[aid]
+            if not len(rows) == len(cols) == len(values):
+                raise ValueError(f"agent {aid}: rows, cols and values differ in length")
+            outside = (rows < 0) | (rows >= self.H) | (cols < 0) | (cols >= self.W)
+            if outside.any():
+                k = int(np.argmax(outside))
+                raise ValueError(f"agent {aid}: cell {[int(rows[k]), int(cols[k])]} outside the {self.H}x{self.W} grid")
+            if not np.isin(values, (0, 1)).all():
+                raise ValueError(f"agent {aid}: cell values must be 0 (free) or 1 (obstacle)")
+
+        cells = np.stack([self.belief_mgr.belief[aid] for aid in agent_ids]).astype(int)
+        for i, aid in enumerate(agent_ids):
+            rows, cols, values = windows[aid]
+            cells[i, rows, cols] = values
+            self.true_map[rows, cols] = values
+
+        self.belief_mgr.set_beliefs(agent_ids, np.where(cells == 0, 0.1, 0.9))
+
+        observations = {}
+        for i, aid in enumerate(agent_ids):
+            pos = tuple(int(x) for x in positions[aid])
+            self.agent_pos[aid] = pos
+            self.visited[aid].add(pos)
+            observations[aid] = self._observation_tuple(aid, pos, cells[i])
+        return observations
+
     # -------------------------------------------------------
     # 5. All Agents at Goal
     # -------------------------------------------------------
@@ -1,11 +1,28 @@
+import sys
 import numpy as np
+from collections import OrderedDict
 
 
 class TreeBuilder:
-    def __init__(self):
+    def __init__(self, max_nodes=None, max_bytes=None, prune="visits"):
+        """
+        Optional memory budget, enforced during search:
+        max_nodes / max_bytes: cap on node count / estimated size in bytes
+        prune: "visits" frees room by dropping the least visited subtrees
+               (see enforce_budget), "stop" just stops expanding when full
+        """
+        if prune not in ("visits", "stop"):
+            raise ValueError(f"unknown prune policy {prune!r}")
+        self.max_nodes = max_nodes
+        self.max_bytes = max_bytes
+        self.prune = prune
 
         self.root = () # root history (empty tuple)
         self.nodes = {} # history -> [parent_history, children_dict, N, V, B]
+        self.bytes = 0 # estimated size of all nodes (see _node_bytes)
+        self.pruned = 0 # nodes dropped by enforce_budget so far
+        self._free = [] # freelist of pruned node dicts, reused for new nodes
+        self.max_node_bytes = 0 # largest node asked for so far, the per-node estimate of enforce_budget
         self._init_root() # initiallize a new root
 
     def _init_root(self):
@@ -15,49 +32,142 @@ class TreeBuilder:
             "N": 0,              # visit count
             "V": 0.0,            # value
             "B": [],             # belief particles (for history nodes)
-            "is_action": False   # False = history/observation node, True = action node
+            "is_action": False,  # False = history/observation node, True = action node
+            "mem": 0             # estimated bytes held by this node
         }
+        self.bytes = self.nodes[self.root]["mem"] = self._node_bytes(self.root)
+
   # ---------------------------------------------------------------------
+    def _node_bytes(self, hist):
+        """
+        Rough size of a node: its dicts, its history key and its label
+        (observation labels are large tuples of (cell, value) pairs).
+        """
+        size = 2 * sys.getsizeof({}) + sys.getsizeof(hist) + 100
+        label = hist[-1] if hist else None
+        if isinstance(label, tuple):
+            size += sys.getsizeof(label) + sum(sys.getsizeof(x) for x in label if isinstance(x, tuple))
+        return size
+
+    def full(self, mem=0):
+        """ True if one more node of `mem` bytes would not fit in the budget. """
+        return (self.max_nodes is not None and len(self.nodes) >= self.max_nodes) or \
+               (self.max_bytes is not None and self.bytes + mem > self.max_bytes)
+
+    def add_node(self, parent, label, is_action):
+        """
+        Create the child `label` of `parent`, reusing a node from the freelist
+        if there is one. Returns its history, or None if the budget is full.
+        """
+        new_hist = parent + (label,)
+        mem = self._node_bytes(new_hist)
+        self.max_node_bytes = max(self.max_node_bytes, mem)
+        if self.full(mem):
+            return None
+        node = self._free.pop() if self._free else {"children": {}}
+        children = node["children"]
+        children.clear()
+        node.clear()  # also drops any data a selection policy kept on the node
+        node.update(parent=parent, children=children, N=0, V=0.0, B=None if is_action else [],
+                    is_action=is_action, mem=mem)
+        self.nodes[new_hist] = node
+        self.nodes[parent]["children"][label] = new_hist
+        self.bytes += node["mem"]
+        return new_hist
+
     def getCreateActionNode(self, history_node, action):
+        """ Returns the action node, or None if it is new and the budget is full. """
         if history_node not in self.nodes:
             raise ValueError("history_node not in tree")
 
         children = self.nodes[history_node]["children"]
 
         if action not in children:
-            new_hist = history_node + (action,)
-            self.nodes[new_hist] = {
-                "parent": history_node,
-                "children": {},
-                "N": 0,
-                "V": 0.0,
-                "B": None,
-                "is_action": True
-            }
-            children[action] = new_hist
+            return self.add_node(history_node, action, is_action=True)
 
         return children[action]
 
-    def getCreateObservationNode(self, action_node, observation):
+    def getCreateObservationNode(self, action_node, observation, widening=None):
+        """
+        widening: optional (k, alpha) progressive widening; a new observation
+        child is only added while len(children) < k * N(action_node)^alpha,
+        otherwise an existing child is followed, chosen proportionally to visits.
+        Returns None if a new node would be needed and the budget is full.
+        """
         if action_node not in self.nodes:
             raise ValueError("action_node not in tree")
 
         children = self.nodes[action_node]["children"]
 
+        if observation not in children and widening is not None and children:
+            k, alpha = widening
+            if len(children) >= k * max(self.nodes[action_node]["N"], 1) ** alpha:
+                return self._sample_child(children)
+
         if observation not in children:
-            new_hist = action_node + (observation,)
-            self.nodes[new_hist] = {
-                "parent": action_node,
-                "children": {},
-                "N": 0,
-                "V": 0.0,
-                "B": [],
-                "is_action": False
-            }
-            children[observation] = new_hist
+            return self.add_node(action_node, observation, is_action=False)
 
         return children[observation]
 
+    def _sample_child(self, children):
+        hists = list(children.values())
+        weights = np.array([self.nodes[h]["N"] + 1 for h in hists], dtype=float)
+        return hists[np.random.choice(len(hists), p=weights / weights.sum())]
+
+    def enforce_budget(self, reserve=0, target=0.75):
+        """
+        Called between simulations (never while one is descending the tree).
+        If fewer than `reserve` nodes could still be added (for a byte budget:
+        `reserve` nodes as large as the largest one seen so far), drop the
+        least visited observation subtrees until the tree is back to `target`
+        of its budget. The root and its action children are always kept.
+        With prune="stop" nothing is dropped and the tree simply stops growing.
+        """
+        if self.prune != "visits" or (self.max_nodes is None and self.max_bytes is None):
+            return
+        node_room = self.max_nodes is None or len(self.nodes) + reserve < self.max_nodes
+        byte_room = self.max_bytes is None or self.bytes + reserve * self.max_node_bytes <= self.max_bytes
+        if node_room and byte_room:
+            return
+
+        max_nodes = None if self.max_nodes is None else target * self.max_nodes
+        max_bytes = None if self.max_bytes is None else target * self.max_bytes
+        candidates = sorted((data["N"], -len(h), h) for h, data in self.nodes.items()
+                            if not data["is_action"] and h != self.root)
+        for _, _, hist in candidates:
+            if (max_nodes is None or len(self.nodes) <= max_nodes) and \
+               (max_bytes is None or self.bytes <= max_bytes):
+                break
+            if hist in self.nodes:  # not already dropped with an ancestor
+                self._drop_subtree(hist)
+
+    def _drop_subtree(self, hist):
+        parent = self.nodes[hist]["parent"]
+        del self.nodes[parent]["children"][hist[-1]]
+        stack = [hist]
+        while stack:
+            node = self.nodes.pop(stack.pop())
+            stack.extend(node["children"].values())
+            self.bytes -= node["mem"]
+            self.pruned += 1
+            if len(self._free) < 4096:
+                self._free.append(node)
+
+    def stats(self):
+        """
+        Size and shape of the tree: node count, observation (history) node
+        count, the max / mean depth of observation nodes in steps below the
+        root, and the estimated bytes.
+        """
+        depths = [len(h) // 2 for h, data in self.nodes.items() if not data["is_action"]]
+        return {
+            "nodes": len(self.nodes),
+            "obs_nodes": len(depths),
+            "max_depth": max(depths),
+            "mean_depth": sum(depths) / len(depths),
+            "bytes": self.bytes,
+        }
+
     def make_root(self, new_root):
         if new_root not in self.nodes:
             raise ValueError("new_root not found in tree")
@@ -83,12 +193,14 @@ class TreeBuilder:
 
             B = data["B"]
             new_nodes[nh] = {
+                **data,  # keeps selection policy data (priors, AMAF stats)
                 "parent": new_parent,
                 "children": {},
                 "N": data["N"],
                 "V": data["V"],
                 "B": None if data["is_action"] else B.copy(),
-                "is_action": data["is_action"]
+                "is_action": data["is_action"],
+                "mem": self._node_bytes(nh)
             }
 
         # fix children pointers
@@ -99,6 +211,110 @@ class TreeBuilder:
 
         self.nodes = new_nodes
         self.root = ()
+        self.bytes = sum(data["mem"] for data in new_nodes.values())
+        self.max_node_bytes = max(data["mem"] for data in new_nodes.values())
+
+class TranspositionTable:
+    """
+    Bounded value cache shared by simulations, keyed on (position, belief) so
+    that different action/observation histories reaching the same state reuse
+    one value estimate.
+
+    States are hashed Zobrist-style: every (cell, belief level) and every
+    position gets a random 64-bit code, the belief hash is the XOR of the codes
+    of its cells and is updated incrementally from the cells that change.
+
+    policy: "lru"   evict the least recently used entry
+            "depth" evict from the shallowest remaining horizon first
+                    (those entries summarize the least search), LRU within it
+    """
+    def __init__(self, H, W, capacity=50000, policy="lru", levels=11, seed=0):
+        if policy not in ("lru", "depth"):
+            raise ValueError(f"unknown replacement policy {policy!r}")
+        rng = np.random.default_rng(seed)
+        self.H, self.W = H, W
+        self.levels = levels
+        self.capacity = capacity
+        self.policy = policy
+        self.z_cells = rng.integers(0, 2**63, size=(H * W, levels), dtype=np.int64)
+        self.z_pos = rng.integers(0, 2**63, size=H * W, dtype=np.int64)
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def clear(self):
+        self.entries = OrderedDict()  # key -> [N, V], least recently used first
+        self.buckets = {}             # "depth" policy: remaining horizon -> OrderedDict of keys, same order
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _quantize(self, belief):
+        return np.rint(np.clip(belief, 0.0, 1.0) * (self.levels - 1)).astype(np.intp).ravel()
+
+    def belief_hash(self, belief):
+        q = self._quantize(belief)
+        return int(np.bitwise_xor.reduce(self.z_cells[np.arange(q.size), q]))
+
+    def update_hash(self, h, belief, next_belief, cells=None):
+        """
+        Belief hash of next_belief from the hash h of belief.
+        cells: flat indices of the cells that may differ (e.g. the ones an
+        observation wrote); only those are quantized and re-hashed. Without it
+        both beliefs are compared in full.
+        """
+        if cells is None:
+            q0, q1 = self._quantize(belief), self._quantize(next_belief)
+            cells = np.flatnonzero(q0 != q1)
+            q0, q1 = q0[cells], q1[cells]
+        else:
+            q0, q1 = self._quantize(belief.ravel().take(cells)), self._quantize(next_belief.ravel().take(cells))
+        if len(cells):
+            z = self.z_cells.ravel()
+            base = cells * self.levels
+            h ^= int(np.bitwise_xor.reduce(z.take(base + q0) ^ z.take(base + q1)))
+        return h
+
+    def key(self, belief_h, pos, remaining):
+        return (belief_h ^ int(self.z_pos[pos[0] * self.W + pos[1]]), remaining)
+
+    def get(self, key):
+        """ [N, V] of a cached state, or None """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touch(key)
+        return entry
+
+    def _touch(self, key):
+        self.entries.move_to_end(key)
+        if self.policy == "depth":
+            self.buckets[key[1]].move_to_end(key)
+
+    def update(self, key, G):
+        """ Add one return G to the running mean of key """
+        entry = self.entries.get(key)
+        if entry is None:
+            if len(self.entries) >= self.capacity:
+                self._evict()
+            entry = self.entries[key] = [0, 0.0]
+            if self.policy == "depth":
+                self.buckets.setdefault(key[1], OrderedDict())[key] = None
+        else:
+            self._touch(key)
+        entry[0] += 1
+        entry[1] += (G - entry[1]) / entry[0]
+
+    def _evict(self):
+        if self.policy == "depth":
+            bucket = self.buckets[min(d for d, b in self.buckets.items() if b)]
+            old, _ = bucket.popitem(last=False)
+            del self.entries[old]
+        else:
+            self.entries.popitem(last=False)
+
 
 def UCB(N, n, V, c=1.0):
     """
@@ -50,6 +50,21 @@ class MapVisualizer:
 
         self.agents = {} # agent_id -> (row,col)
         self.goals = {} # goal_id -> (row,col)
+
+        self._background = None # cached static surface (obstacles, legend, goals), see _build_background
+        self._screen_ready = False # True once the full frame has been drawn at least once
+
+        # Planner overlay (belief heatmap + root visit counts), see enable_overlay
+        self.overlay_on = False
+        self.overlay_fps = 2 # overlay refresh rate, independent of the planning loop
+        self.overlay_alpha = 110
+        self.overlay_agent = None # agent whose belief and tree are shown
+        self._belief_mgr = None
+        self._planners = {}
+        self._heatmap = None
+        self._visits_layer = None
+        self._overlay_time = None # pg ticks (ms) of the last overlay render
+        self._action_offsets = {"up": (-1, 0), "down": (1, 0), "left": (0, -1), "right": (0, 1)} # (drow, dcol)
     def agent_start_goal(self):
         
         
@@ -59,83 +74,237 @@ class MapVisualizer:
         # Assign agents and goals with unique IDs
         self.agents = {i+1: tuple(pos) for i, pos in enumerate(agents_list)}
         self.goals  = {i+1: tuple(pos) for i, pos in enumerate(goals_list)}
+        self._background = None # legend and goals changed: re-render on next draw
+        self._screen_ready = False
 
         return self.agents, self.goals
 
-    def draw_map(self):
-        ''' Draw the grid, obstacles, agents, and goals
-        draw the agents as circles and goals as squares
+    def _cell_rect(self, pos):
+        ''' Screen rect of the grid cell pos=(row,col) '''
+        return pg.Rect(pos[1]*self.cell_size, pos[0]*self.cell_size, self.cell_size, self.cell_size) # pygame uses (x,y) so col,row
+
+    def _cell_center(self, pos):
+        return (pos[1]*self.cell_size + self.cell_size//2, pos[0]*self.cell_size + self.cell_size//2)
 
+    def _build_background(self):
+        ''' Pre-render everything that never moves: grid, obstacles, legend and goals.
+        Built once and reused by every frame instead of redrawing it cell by cell.
         '''
-        self.screen.fill(self.bg_color)
-
-        # Draw obstacles 
-        for r in range(self.H):
-            for c in range(self.W):
-                if self.grid[r, c] == 1:
-                    pg.draw.rect(self.screen, self.obstacle_color,
-                                     (c*self.cell_size, r*self.cell_size, self.cell_size, self.cell_size)) # pg.draw.rec(x, (x,y,w,h))
-                    
+        background = pg.Surface((self.screen_width, self.screen_height))
+        background.fill(self.bg_color)
+
+        # Draw obstacles: one pixel per cell, scaled up to the cell size in a single blit
+        cells = np.where((self.grid == 1)[..., None], self.obstacle_color, self.bg_color).astype(np.uint8)
+        cells_surface = pg.surfarray.make_surface(cells.transpose(1, 0, 2)) # surfarray is indexed (x,y) so col,row
+        background.blit(pg.transform.scale(cells_surface, (self.W*self.cell_size, self.H*self.cell_size)), (0, 0))
+
         # Fill legend area with a slightly different color
         legend_x = self.W * self.cell_size # start of legend area
         legend_width = self.screen_width - legend_x # width of legend area
-        pg.draw.rect(self.screen, self.obstacle_color, (legend_x, 0, legend_width, self.screen_height)) #pg.draw.rec(x, (x,y,w,h))
+        pg.draw.rect(background, self.obstacle_color, (legend_x, 0, legend_width, self.screen_height)) #pg.draw.rec(x, (x,y,w,h))
 
-
-        # Draw agents and goals
+        # Legend entries and goals
+        self._colors = {}
         for i, agent_id in enumerate(self.agents.keys()):
-            # grab agent and goal positions
-            agent_pos = self.agents[agent_id]
             goal_pos = self.goals[agent_id]
-            #get the colors for the agents and goals
             color = self.agent_colors[i% len(self.agent_colors)]
-            
+            self._colors[agent_id] = color
+
             # legend position
             x = self.W * self.cell_size -20  # left margin
-            y = 10 + i * 25  # vertical spacing between agent  
-            
-
+            y = 10 + i * 25  # vertical spacing between agent
 
             # Draw color box
-            pg.draw.rect(self.screen, color, (x, y, 20, 20))
+            pg.draw.rect(background, color, (x, y, 20, 20))
             # Draw agent ID next to the box
             text_surface = self.font.render(f"Agent {agent_id}", True, (0, 0, 0)) # .render(text, antialias, color)
-            self.screen.blit(text_surface, (x + 25, y)) # .blit(surface, (x,y))
+            background.blit(text_surface, (x + 25, y)) # .blit(surface, (x,y))
 
-            # draw the agent as circle
-            pg.draw.circle(self.screen, color,
-                               (agent_pos[1]*self.cell_size + self.cell_size//2,
-                                agent_pos[0]*self.cell_size + self.cell_size//2),
-                               self.cell_size//3, 3)  # pygame uses (x,y) so col,row
             # draw the goal as square
-            pg.draw.rect(self.screen, color,
+            pg.draw.rect(background, color,
                              (goal_pos[1]*self.cell_size + self.cell_size//4,
                               goal_pos[0]*self.cell_size + self.cell_size//4,
                               self.cell_size//2, self.cell_size//2)) # pygame uses (x,y) so col,row
 
+        self._background = background
+        self._trail_layer = pg.Surface((self.screen_width, self.screen_height), pg.SRCALPHA) # transparent, trails are drawn on it incrementally
+        self._trail_drawn = {} # agent_id -> number of trail points already on the trail layer
+
+    # -------------------------------------------------------
+    # Planner overlay
+    # -------------------------------------------------------
+    def enable_overlay(self, belief_mgr, planners=None, overlay_fps=2, agent_id=None, show=True):
+        '''
+        Show what the planner believes: the belief map of one agent as a heatmap
+        and the root action visit counts of its search tree as arrows.
+        belief_mgr: BeliefManager whose .belief is rendered
+        planners: dict agent_id -> POMCPAgent (e.g. MultiAgentController.agents)
+        overlay_fps: how often the overlay is rebuilt, lower than the frame rate
+        show: display it right away (otherwise wait for toggle_overlay)
+        '''
+        self._belief_mgr = belief_mgr
+        self._planners = planners or {}
+        self.overlay_fps = max(0.1, min(60, overlay_fps))
+        self.overlay_agent = agent_id if agent_id is not None else next(iter(belief_mgr.belief))
+        self.overlay_on = show
+        self._overlay_time = None
+        self._screen_ready = False
+
+    def toggle_overlay(self):
+        self.overlay_on = not self.overlay_on and self._belief_mgr is not None
+        self._overlay_time = None
+        self._screen_ready = False # full redraw on next update
+
+    def next_overlay_agent(self):
+        ''' Cycle the overlay through the agents '''
+        if self._belief_mgr is None:
+            return
+        ids = list(self._belief_mgr.belief.keys())
+        self.overlay_agent = ids[(ids.index(self.overlay_agent) + 1) % len(ids)]
+        self._overlay_time = None
+
+    def _render_overlay(self):
+        '''
+        Rebuild the heatmap from the belief array in one surfarray blit,
+        and the visit-count arrows from the root of the agent's tree.
+        '''
+        belief = np.clip(self._belief_mgr.belief[self.overlay_agent], 0.0, 1.0)
+        heat = np.empty((self.W, self.H, 3), dtype=np.uint8) # surfarray is indexed (x,y) so col,row
+        heat[..., 0] = (255 * belief.T).astype(np.uint8) # likely obstacle -> red
+        heat[..., 1] = 0
+        heat[..., 2] = (255 * (1 - belief.T)).astype(np.uint8) # likely free -> blue
+        heatmap = pg.transform.scale(pg.surfarray.make_surface(heat), (self.W*self.cell_size, self.H*self.cell_size))
+        heatmap.set_alpha(self.overlay_alpha)
+        self._heatmap = heatmap
+
+        self._visits_layer = pg.Surface((self.screen_width, self.screen_height), pg.SRCALPHA)
+        planner = self._planners.get(self.overlay_agent)
+        if planner is not None:
+            visits = planner.root_action_visits()
+            total = sum(visits.values())
+            pos = self.agents.get(self.overlay_agent)
+            if total > 0 and pos is not None:
+                x, y = self._cell_center(pos)
+                color = self._colors.get(self.overlay_agent, (255, 255, 255))
+                for action, n in visits.items():
+                    share = n / total
+                    if share == 0:
+                        continue
+                    width = max(1, int(share * self.cell_size // 3))
+                    if action == "stay":
+                        pg.draw.circle(self._visits_layer, color, (x, y), width)
+                        continue
+                    drow, dcol = self._action_offsets[action]
+                    end = (x + dcol*self.cell_size, y + drow*self.cell_size)
+                    pg.draw.line(self._visits_layer, color, (x, y), end, width)
+
+        self._overlay_time = pg.time.get_ticks()
+        self._screen_ready = False # overlay changed everywhere: redraw the full frame
+
+    def _overlay_due(self):
+        if not self.overlay_on:
+            return False
+        if self._overlay_time is None:
+            return True
+        return pg.time.get_ticks() - self._overlay_time >= 1000 / self.overlay_fps
+
+    def _blit_layers(self, rect=None):
+        ''' Blit background, overlay and trails onto the screen (whole screen or one rect) '''
+        for layer in (self._background,
+                      self._heatmap if self.overlay_on else None,
+                      self._visits_layer if self.overlay_on else None,
+                      self._trail_layer):
+            if layer is None:
+                continue
+            if rect is None:
+                self.screen.blit(layer, (0, 0))
+            else:
+                self.screen.blit(layer, rect, rect)
+
+    def _draw_agent(self, agent_id):
+        # draw the agent as circle
+        pg.draw.circle(self.screen, self._colors[agent_id], self._cell_center(self.agents[agent_id]),
+                           self.cell_size//3, 3)
+
+    def draw_map(self):
+        ''' Draw the grid, obstacles, agents, and goals
+        draw the agents as circles and goals as squares
+
+        '''
+        if self._background is None:
+            self._build_background()
+
+        if self._overlay_due():
+            self._render_overlay()
+
+        self._blit_layers()
+        for agent_id in self.agents.keys():
+            self._draw_agent(agent_id)
+
         pg.display.flip() # update the full display
+        self._screen_ready = True
         self.clock.tick(self.fps)
 
+    def _extend_trails(self, trails):
+        '''
+        Draw only the trail segments added since the last frame onto the trail layer.
+        Returns the screen rects they cover.
+        '''
+        dirty = []
+        for agent_id, path in trails.items(): # path is list of (row,col)
+            drawn = self._trail_drawn.get(agent_id, 0)
+            if len(path) < drawn: # trail was reset (new episode): start the layer over
+                self._trail_layer.fill((0, 0, 0, 0))
+                self._trail_drawn = {}
+                self._screen_ready = False
+                return self._extend_trails(trails)
+            if len(path) > 1 and len(path) > drawn:
+                color = self.agent_colors[(agent_id-1) % len(self.agent_colors)] # consistent color per agent
+                points = [self._cell_center(p) for p in path[max(drawn - 1, 0):]]
+                if len(points) > 1:
+                    dirty.append(pg.draw.lines(self._trail_layer, color, False, points, 3)) # .draw.lines(surface, color, closed, pointlist, width=0)
+            self._trail_drawn[agent_id] = len(path)
+        return dirty
+
     def update_agents(self, new_positions, trails=None):
         """
         Update agents to new positions (list of tuples)
         new_positions: list of (agent_id, (row,col)) for each agent
+        Only the screen areas that changed (moved agents, new trail segments) are redrawn.
         """
+        if self._background is None:
+            self._build_background()
+
+        dirty = []
         for agent_id, pos in new_positions:
+            old_pos = self.agents.get(agent_id)
             self.agents[agent_id] = pos # update position by agent_id before redrawing
-        self.draw_map()
+            if old_pos != pos:
+                dirty.append(self._cell_rect(pos))
+                if old_pos is not None:
+                    dirty.append(self._cell_rect(old_pos))
 
-         # Draw trails if provided
+        # Draw trails if provided
         if trails:
-            for agent_id, path in trails.items(): # path is list of (row,col)
-                color = self.agent_colors[(agent_id-1) % len(self.agent_colors)] # consistent color per agent
-                if len(path) > 1:
-                    pg.draw.lines(self.screen, color,
-                                  False,
-                                  [(c*self.cell_size + self.cell_size//2,
-                                    r*self.cell_size + self.cell_size//2) for r,c in path], 3) # .draw.lines(surface, color, closed, pointlist, width=0)
-        pg.display.flip() # update the full display
+            dirty.extend(self._extend_trails(trails))
+
+        if self._overlay_due():
+            self._render_overlay()
+
+        if not self._screen_ready:
+            self.draw_map()
+            return
+
+        # restore the static background, overlay and trails under every dirty rect, then the agents on top
+        for rect in dirty:
+            self._blit_layers(rect)
+        for agent_id in self.agents.keys():
+            if self._cell_rect(self.agents[agent_id]).collidelist(dirty) != -1:
+                self._draw_agent(agent_id)
+
+        pg.display.update(dirty) # update only the changed areas
         self.clock.tick(self.fps)
+
     def set_fps(self, fps):
         self.fps = max(1, min(60, fps))
 
@@ -1,67 +1,103 @@
 
+import queue
 import pygame as pg
 from Visualization_Map import MapVisualizer as MV
 from DataLoading import DataLoader as DL
 from BeliefStateManager import BeliefManager as BM
 from State_Manager import StateManager as SM
 from MAC import MultiAgentController as MAC
-
-def run_episode(controller: MAC,state_mgr: SM,belief_mgr: BM,viz: MV,max_steps=50,n_simulations=200,verbose=True):
+from PlannerWorker import PlannerWorker
+from EpisodeTrace import TraceWriter
+from Checkpoint import Checkpointer
+
+def run_episode(controller: MAC,state_mgr: SM,belief_mgr: BM,viz: MV,max_steps=50,n_simulations=200,verbose=True,trace_path=None,checkpoint_path=None,checkpoint_every=10):
+    """
+    Planning runs in a PlannerWorker thread; this loop only handles pygame
+    events and draws the completed steps, one per frame at viz.fps.
+    SPACE pauses/resumes, N (or RIGHT) steps once while paused.
+    trace_path: if given, the episode is recorded there (see EpisodeTrace)
+    checkpoint_path: if given, the planner state is checkpointed there every
+    checkpoint_every steps, and the episode resumes from it if it exists (see Checkpoint)
+    """
     paused = False
+    display_budget = 0 # steps the user asked to see while paused
+    finished = False
     total_rewards = {aid: 0.0 for aid in controller.agent_ids}
 
-    for t in range(max_steps):
-
-        # check termination
-        if state_mgr.all_agents_at_goal():
-            if verbose:
-                print(f"Episode ended at step {t}: all agents at goal.")
-            break
-
-        # one decentralized POMCP step
-        joint_action, observations, rewards = controller.step(n_simulations)
-
-
-        # accumulate rewards
-        for aid, r in rewards.items():
-            total_rewards[aid] += r
+    checkpointer = Checkpointer(checkpoint_path, controller, every=checkpoint_every) if checkpoint_path else None
+    start_step = checkpointer.resume() if checkpointer else 0
+    if verbose and start_step:
+        print(f"Resumed from checkpoint at step {start_step}")
 
-        # update visualization
-        new_positions = [(aid, state_mgr.agent_pos[aid]) for aid in controller.agent_ids]
-        viz.update_agents(new_positions, trails=controller.trails)
+    positions = {aid: state_mgr.agent_pos[aid] for aid in controller.agent_ids}
+    trails = {aid: list(controller.trails[aid]) for aid in controller.agent_ids} # built from published steps, the controller runs ahead
 
-        if verbose:
-            print(f"Step {t}")
-            print("  Actions: ", {aid: str(a) for aid, a in joint_action.items()})
-            print("  Rewards:", {aid: float(r) for aid, r in rewards.items()})
-
-        # allow pygame to process events
-        for event in pg.event.get():
-            if event.type == pg.QUIT:
-                return total_rewards
-
-            if event.type == pg.KEYDOWN:
-                if event.key == pg.K_SPACE:
-                    paused = not paused
-        while paused:
+    trace = TraceWriter(trace_path, controller, start_step=start_step) if trace_path else None
+    worker = PlannerWorker(controller, state_mgr, n_simulations, max_steps, trace, checkpointer, start_step)
+    worker.start()
+    try:
+        while True:
+            # allow pygame to process events
             for event in pg.event.get():
                 if event.type == pg.QUIT:
                     return total_rewards
-                if event.type == pg.KEYDOWN and event.key == pg.K_SPACE:
-                    paused = False
-            viz.clock.tick(60)
 
-
-    if verbose:
-        print("Total rewards:", {aid: float(r) for aid, r in total_rewards.items()})
-    running = True 
-    print("Episode finished") 
-    while running: 
-        for event in pg.event.get(): 
-            if event.type == pg.QUIT: 
-                running = False 
-                viz.clock.tick(60)
-    return total_rewards
+                if event.type == pg.KEYDOWN:
+                    if event.key == pg.K_SPACE:
+                        paused = not paused
+                        display_budget = 0
+                        if paused:
+                            worker.pause()
+                        else:
+                            worker.resume()
+                    elif event.key in (pg.K_n, pg.K_RIGHT) and paused:
+                        display_budget += 1
+                        if worker.steps.qsize() < display_budget:
+                            worker.step_once()
+                    elif event.key == pg.K_b: # belief / search-tree overlay on/off
+                        viz.toggle_overlay()
+                    elif event.key == pg.K_TAB: # overlay of the next agent
+                        viz.next_overlay_agent()
+
+            # consume at most one completed step per frame
+            if not finished and (not paused or display_budget > 0):
+                try:
+                    msg = worker.steps.get_nowait()
+                except queue.Empty:
+                    msg = None
+
+                if msg is not None and msg[0] == "error":
+                    raise msg[1]
+
+                if msg is not None and msg[0] == "done":
+                    _, t, all_at_goal = msg
+                    finished = True
+                    if verbose:
+                        if all_at_goal:
+                            print(f"Episode ended at step {t}: all agents at goal.")
+                        print("Total rewards:", {aid: float(r) for aid, r in total_rewards.items()})
+                    print("Episode finished")
+
+                if msg is not None and msg[0] == "step":
+                    _, t, joint_action, observations, rewards, positions = msg
+                    if paused:
+                        display_budget -= 1
+
+                    # accumulate rewards
+                    for aid, r in rewards.items():
+                        total_rewards[aid] += r
+                    for aid in controller.agent_ids:
+                        trails[aid].append(positions[aid])
+
+                    if verbose:
+                        print(f"Step {t}")
+                        print("  Actions: ", {aid: str(a) for aid, a in joint_action.items()})
+                        print("  Rewards:", {aid: float(r) for aid, r in rewards.items()})
+
+            # update visualization (also refreshes the overlay when due, and ticks the clock)
+            viz.update_agents([(aid, positions[aid]) for aid in controller.agent_ids], trails=trails)
+    finally:
+        worker.cancel() # stops in-flight planning
 
 
 if __name__ == "__main__":
@@ -79,6 +115,9 @@ if __name__ == "__main__":
 
     # Create multi-agent controller
     controller = MAC(state_mgr, belief_mgr, agents.keys(),gamma=0.99, horizon=3)
+
+    # Planner overlay (press B to toggle, TAB to switch agent)
+    viz.enable_overlay(belief_mgr, controller.agents, overlay_fps=2, show=False)
     # Run episode with visualization
     run_episode(controller, state_mgr, belief_mgr, viz,max_steps=500,n_simulations=22,verbose=True)
 
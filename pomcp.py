@@ -1,26 +1,79 @@
-from Tree import TreeBuilder, UCB
+from Tree import TreeBuilder, TranspositionTable
+from SelectionPolicy import SelectionPolicy, make_policy
 import numpy as np
 from BeliefStateManager import BeliefManager as BM
-from State_Manager import StateManager as SM
+from State_Manager import StateManager as SM, OBS_RADIUS
 
 
 class POMCPAgent:
     def __init__(self, agent_id, state_mgr: SM,
-                 belief_mgr: BM, gamma=0.95, horizon=10):
+                 belief_mgr: BM, gamma=0.95, horizon=10,
+                 transpositions: TranspositionTable = None, keep_transpositions=False,
+                 transposition_min_visits=1, widening=None, bucket_radius=None,
+                 max_nodes=None, max_tree_bytes=None, prune="visits", selection: SelectionPolicy = None):
         self.agent_id = agent_id
         self.state_mgr = state_mgr
         self.belief_mgr = belief_mgr
         self.gamma = gamma
         self.horizon = horizon
-        self.tree = TreeBuilder()
+
+        # optional memory budget of the search tree (see TreeBuilder)
+        self.max_nodes = max_nodes
+        self.max_tree_bytes = max_tree_bytes
+        self.prune = prune
+        self.tree = self.new_tree()
         self.actions = ["up", "down", "left", "right", "stay"]
 
-    def bestAction(self, n_simulations=100):
+        # tree policy (see SelectionPolicy), default: untried first, then UCB
+        self.selection = make_policy(selection)
+        self._trace = None  # this simulation's actions by depth, if the policy wants them
+        self._window_hash = False  # see _changed_cells
+        self._window_cells = {}  # (pos, next_pos) -> flat cells of both observation windows
+
+        # optional value cache keyed on (position, belief), shared by all simulations
+        self.transpositions = transpositions
+        self.keep_transpositions = keep_transpositions  # also share it across steps
+        self.transposition_min_visits = transposition_min_visits
+
+        # observation branching: progressive widening (k, alpha) and coarse observation keys
+        self.widening = widening
+        if bucket_radius is not None and not 0 <= bucket_radius <= OBS_RADIUS:
+            # the real observation is keyed from the true map, beyond the observed cells that would leak it
+            raise ValueError(f"bucket_radius must be between 0 and the observation radius {OBS_RADIUS}, "
+                             f"got {bucket_radius}")
+        self.bucket_radius = bucket_radius
+
+    def new_tree(self):
+        """ Empty search tree with this agent's memory budget. """
+        return TreeBuilder(self.max_nodes, self.max_tree_bytes, self.prune)
+
+    def memory_usage(self):
+        """
+        Current footprint of the search tree: node count, estimated bytes,
+        the budget (None = unbounded) and how many nodes were pruned so far.
+        """
+        tree = self.tree
+        return {"nodes": len(tree.nodes), "bytes": tree.bytes,
+                "max_nodes": tree.max_nodes, "max_bytes": tree.max_bytes, "pruned": tree.pruned}
+
+    def bestAction(self, n_simulations=100, cancel=None):
         """
         Run POMCP for this agent only.
+        cancel: optional threading.Event, stops the search early when set.
         Returns: best local action for this agent.
         """
+        belief_h = None
+        if self.transpositions is not None:
+            if not self.keep_transpositions:
+                self.transpositions.clear()
+            belief_h = self.transpositions.belief_hash(self.belief_mgr.belief[self.agent_id])
+            self._window_hash = self.belief_mgr.belief[self.agent_id].max() < 1.0
+
         for _ in range(n_simulations):
+            if cancel is not None and cancel.is_set():
+                break
+            # a simulation adds at most two nodes per step, make room before it starts
+            self.tree.enforce_budget(reserve=2 * self.horizon)
             # sample a map from this agent's belief
             map_sample = self._sample_map()
             state = {
@@ -28,7 +81,8 @@ class POMCPAgent:
                 "map": map_sample
             }
             belief = self.belief_mgr.belief[self.agent_id].copy()
-            self._simulate(self.tree.root, state, belief, depth=0)
+            self._trace = [] if self.selection.uses_trace else None
+            self._simulate(self.tree.root, state, belief, depth=0, belief_h=belief_h)
 
         # pick best action from root
         root_node = self.tree.nodes[self.tree.root]
@@ -47,10 +101,32 @@ class POMCPAgent:
 
         return best_a
 
-    def _simulate(self, history, state, belief, depth):
+    def root_action_visits(self):
+        """
+        Visit count N of every action tried at the root of the search tree.
+        Safe to call from another thread while planning: make_root replaces
+        tree.nodes and pruning deletes from it, so the dict is bound once and
+        children that are gone are skipped.
+        """
+        nodes = self.tree.nodes
+        root = nodes.get(())
+        if root is None:
+            return {}
+        visits = {}
+        for a, a_hist in list(root["children"].items()):
+            a_node = nodes.get(a_hist)
+            if a_node is not None:
+                visits[a] = a_node["N"]
+        return visits
+
+    def _simulate(self, history, state, belief, depth, belief_h=None):
         if depth >= self.horizon:
             return 0.0
 
+        tt_key = None
+        if self.transpositions is not None:
+            tt_key = self.transpositions.key(belief_h, state["pos"], self.horizon - depth)
+
         # expand history node if not in tree
         if history not in self.tree.nodes:
             self.tree.nodes[history] = {
@@ -61,16 +137,32 @@ class POMCPAgent:
                 "B": [],
                 "is_action": False
             }
-            return self._rollout(state, belief, depth)
+            return self._rollout(state, belief, depth, belief_h)
 
         node = self.tree.nodes[history]
         node["N"] += 1
 
+        # first visit of a state already searched through another history: reuse its value
+        if tt_key is not None and node["N"] == 1 and depth > 0:
+            cached = self._cached_value(tt_key)
+            if cached is not None:
+                node["V"] += (cached - node["V"]) / node["N"]
+                return cached
+
         # select action
         action = self._select_action(state, history, node)
 
         # action node
         a_hist = self.tree.getCreateActionNode(history, action)
+        if a_hist is None:
+            # tree is full: estimate by rollout instead of expanding
+            G = self._rollout(state, belief, depth, belief_h)
+            node["V"] += (G - node["V"]) / node["N"]
+            if self._trace is not None:
+                self.selection.backup(node, self._trace[depth:], G)
+            return G
+        if self._trace is not None:
+            self._trace.append(action)
         a_node = self.tree.nodes[a_hist]
 
         # transition
@@ -80,25 +172,30 @@ class POMCPAgent:
         obs = self._observe(next_state, belief)
 
         # update belief locally
-        next_belief = belief.copy()
-        for key, v in obs:
-            if isinstance(key, tuple) and len(key) == 2 and isinstance(key[0], int):
-                r, c = key
-                next_belief[r, c] = 0.1 if v == 0 else 0.9
+        next_belief = self._next_belief(next_state, belief)
 
         # observation node
-        o_hist = self.tree.getCreateObservationNode(a_hist, obs)
+        o_key = self.observation_key(obs, next_state["pos"], next_state["map"])
+        o_hist = self.tree.getCreateObservationNode(a_hist, o_key, self.widening)
 
         # reward (per-agent)
         r = self._reward(state, action, next_state, belief, next_belief)
 
         # recursive simulate
-        G = r + self.gamma * self._simulate(o_hist, next_state, next_belief, depth + 1)
+        next_h = None
+        if tt_key is not None:
+            next_h = self.transpositions.update_hash(belief_h, belief, next_belief,
+                                                     self._changed_cells(state["pos"], next_state["pos"], depth))
+        if o_hist is None:
+            # tree is full: continue below this action by rollout
+            G = r + self.gamma * self._rollout(next_state, next_belief, depth + 1, next_h)
+        else:
+            G = r + self.gamma * self._simulate(o_hist, next_state, next_belief, depth + 1, next_h)
 
-        # Backup observation node
-        o_node = self.tree.nodes[o_hist]
-        o_node["N"] += 1
-        o_node["V"] += (G - o_node["V"]) / o_node["N"]
+            # Backup observation node
+            o_node = self.tree.nodes[o_hist]
+            o_node["N"] += 1
+            o_node["V"] += (G - o_node["V"]) / o_node["N"]
 
 
         # backup on action node
@@ -107,40 +204,83 @@ class POMCPAgent:
 
         # Backup history node
         node["V"] += (G - node["V"]) / node["N"]
+        if self._trace is not None:
+            self.selection.backup(node, self._trace[depth:], G)
+
+        if tt_key is not None:
+            self.transpositions.update(tt_key, G)
 
         return G
 
-    def _greedy_goal_action(self, state):
-        pos = state["pos"]
+    def observation_key(self, obs, pos, map_grid):
+        """
+        Label of an observation in the search tree: the observation itself, or
+        with bucket_radius its local signature over that radius
+        (see StateManager.local_signature).
+        """
+        if self.bucket_radius is None:
+            return obs
+        return self.state_mgr.local_signature(self.agent_id, pos, map_grid, self.bucket_radius)
+
+    def _cached_value(self, tt_key):
+        """ Value of a transposition, if it has been backed up often enough. """
+        entry = self.transpositions.get(tt_key)
+        if entry is None or entry[0] < self.transposition_min_visits:
+            return None
+        return entry[1]
+
+    def goal_distances(self, state):
+        """ Manhattan distance to the goal after each action: {action: distance}. """
         goal = self.state_mgr.goal_pos[self.agent_id]
-        best_a, best_d = None, float("inf")
-
+        dist = {}
         for a in self.actions:
             next_pos = self.state_mgr.single_agent_transition(self.agent_id, state, a)["pos"]
-            d = abs(next_pos[0] - goal[0]) + abs(next_pos[1] - goal[1])
+            dist[a] = abs(next_pos[0] - goal[0]) + abs(next_pos[1] - goal[1])
+        return dist
+
+    def _greedy_goal_action(self, state):
+        best_a, best_d = None, float("inf")
+
+        for a, d in self.goal_distances(state).items():
             if d < best_d:best_d, best_actions = d, [a]
             elif d == best_d: best_actions.append(a)
         return np.random.choice(best_actions)
 
-    def _rollout(self, state, belief, depth):
+    def _rollout(self, state, belief, depth, belief_h=None):
         if depth >= self.horizon:
             return 0.0
+
+        tt_key = None
+        if self.transpositions is not None:
+            tt_key = self.transpositions.key(belief_h, state["pos"], self.horizon - depth)
+            cached = self._cached_value(tt_key)
+            if cached is not None:
+                return cached
+
         # Action selection
         if np.random.rand() < 0.9:
             action = self._greedy_goal_action(state)
         else:
             action = np.random.choice(self.actions)
+        if self._trace is not None:
+            self._trace.append(action)
 
         next_state = self._transition(state, action)
-        obs = self._observe(next_state, belief)
 
-        # update local belief copy
-        next_belief = belief.copy()
-        for (r, c), v in obs:
-            next_belief[r, c] = 0.1 if v == 0 else 0.9
+        # update local belief copy (the observation itself is not needed here)
+        next_belief = self._next_belief(next_state, belief)
 
         r = self._reward(state, action, next_state, belief, next_belief)
-        return r + self.gamma * self._rollout(next_state, next_belief, depth + 1)
+
+        next_h = None
+        if tt_key is not None:
+            next_h = self.transpositions.update_hash(belief_h, belief, next_belief,
+                                                     self._changed_cells(state["pos"], next_state["pos"], depth))
+        G = r + self.gamma * self._rollout(next_state, next_belief, depth + 1, next_h)
+
+        if tt_key is not None:
+            self.transpositions.update(tt_key, G)
+        return G
 
 
     def _transition(self, state, action):
@@ -151,7 +291,36 @@ class POMCPAgent:
         Local observation for this agent using the sampled map.
         """
         pos = state["pos"]
-        return self.state_mgr.observation(self.agent_id,pos,state["map"],belief,self.state_mgr.H,self.state_mgr.W,radius=2)
+        return self.state_mgr.observation(self.agent_id,pos,state["map"],belief,self.state_mgr.H,self.state_mgr.W,radius=OBS_RADIUS)
+
+    def _next_belief(self, state, belief):
+        """
+        Local belief after observing from state: every cell of the observation
+        becomes 0.1 if free, 0.9 otherwise. Same result as applying the
+        observation tuple cell by cell, without building it.
+        """
+        sm = self.state_mgr
+        cells = sm.observed_cells(state["pos"], state["map"], belief, sm.H, sm.W, radius=OBS_RADIUS)
+        return np.where(cells == 0, 0.1, 0.9)
+
+    def _changed_cells(self, pos, next_pos, depth):
+        """
+        Cells the observation from next_pos can change in the simulated belief,
+        for the transposition hash (None: compare the beliefs in full).
+        _next_belief sets every cell outside the window to 0.1 (the belief is
+        below 1 there), so below the root, where the belief came from an
+        observation at pos, only the windows at pos and next_pos can differ.
+        The root belief is the real one and can differ anywhere.
+        """
+        if depth == 0 or not self._window_hash:
+            return None
+        cells = self._window_cells.get((pos, next_pos))
+        if cells is None:
+            sm = self.state_mgr
+            windows = [sm._window(p[0], p[1], sm.H, sm.W, OBS_RADIUS) for p in (pos, next_pos)]
+            cells = np.union1d(*(rows * sm.W + cols for rows, cols in windows))
+            self._window_cells[(pos, next_pos)] = cells
+        return cells
 
     def _reward(self, state, action, next_state, belief, next_belief):
         """
@@ -163,36 +332,15 @@ class POMCPAgent:
             {"agent_pos": {self.agent_id: state["pos"]}},
             action,
             {"agent_pos": {self.agent_id: next_state["pos"]}},
-            belief,
-            next_belief)
+            {self.agent_id: belief},
+            {self.agent_id: next_belief})
 
 
     def _select_action(self, state, history, node):
         """
-        Simple POMCP action selection with UCB over local actions.
+        Action to descend from history node, chosen by the selection policy.
         """
-        children = node["children"]
-
-        # explore untried actions first
-        untried = [a for a in self.actions if a not in children]
-        if untried:
-            a = self._greedy_goal_action(state)
-            if a in untried:
-                return a
-            
-            return np.random.choice(untried)
-
-        # otherwise use UCB
-        N = node["N"]
-        best_a, best_score = None, -float("inf")
-        for a in self.actions:
-            a_hist = children[a]
-            a_node = self.tree.nodes[a_hist]
-            score = UCB(N, a_node["N"], a_node["V"], c=3.0)
-            if score > best_score:
-                best_score = score
-                best_a = a
-        return best_a
+        return self.selection.select(self, state, node)
 
     def _sample_map(self):
         """